@@ -1,12 +1,18 @@
 import streamlit as st
-import sqlite3, os
+import os
 from dotenv import load_dotenv
+from streamlit_folium import st_folium
 
 # --- Imports internes ---
 from mods.geocode import geocode_appointments, geocode_depots
 from mods.clustering import clustering
-from mods.tsr_plan import TSP
-from mods.models import Client, Appointment, Travel
+from mods.tsr_plan import TSP, VRP
+from mods.routing import get_provider
+from mods.db import ui_connection
+from mods.jobs import submit_job, latest_job
+from mods.ui_data import load_depots, load_itinerary_clusters, load_cluster_itinerary, load_cluster_route
+from mods.map_gen import cluster_map
+from mods.itineraries import build_travels
 from mods.use_tools import fmt_time_iso
 
 
@@ -14,20 +20,27 @@ from mods.use_tools import fmt_time_iso
 load_dotenv(dotenv_path=".secret")
 DB_PATH = os.getenv("DB_PATH")
 ORS_API_KEY = os.getenv("ORS_API_KEY")
+ROUTING_PROVIDER = os.getenv("ROUTING_PROVIDER", "ors")  # ors | local | haversine
+ROUTING_GRAPH = os.getenv("ROUTING_GRAPH")  # graphe .npz pour le routage local
+CLUSTERING_METHOD = os.getenv("CLUSTERING_METHOD", "chain")  # chain | sweep | kmeans | agglomerative
+PLANNING_MODE = os.getenv("PLANNING_MODE", "tsp")  # tsp | vrp | vrp-global (sans clustering)
+TSP_TIME_POLICY = os.getenv("TSP_TIME_POLICY", "adaptive")  # fixed | adaptive
+MAP_CACHE_DIR = os.getenv("MAP_CACHE_DIR", "map_cache")  # artefacts GeoJSON par cluster
 
-st.title("📅 Agendix Routing - Optimisation des tournées")
 
-# --- Connexion DB ---
-conn = sqlite3.connect(DB_PATH)
-conn.row_factory = sqlite3.Row  # pour ORM
-c = conn.cursor()
+@st.cache_resource(show_spinner=False)
+def map_provider():
+    """Fournisseur de routage des tracés de carte (partagé entre sessions)."""
+    return get_provider(ROUTING_PROVIDER, ORS_API_KEY, ROUTING_GRAPH)
+
+
+st.title("📅 Agendix Routing - Optimisation des tournées")
 
 # --------------------------------------------------
 # 1. Sélection du voyageur (dépôt)
 # --------------------------------------------------
 st.subheader("👤 Choix du Voyageur")
-c.execute("SELECT id, nom, ville FROM depots")
-depots = c.fetchall()
+depots = load_depots(DB_PATH)
 
 if not depots:
     st.warning("⚠️ Aucun dépôt trouvé dans la base. Veuillez en créer un dans la page Dépôts.")
@@ -43,132 +56,127 @@ depot_id = depots[[f"{nom} ({ville})" for _, nom, ville in depots].index(travele
 # 2. Bouton pour lancer l’optimisation
 # --------------------------------------------------
 st.subheader("⚙️ Optimisation")
+JOB_KIND = "optimisation"
+
+
+def optimisation_stages():
+    """Étapes du pipeline, exécutées dans un thread de fond (mods.jobs)."""
+    def plan():
+        provider = get_provider(ROUTING_PROVIDER, ORS_API_KEY, ROUTING_GRAPH)
+        if PLANNING_MODE == "tsp":
+            TSP(DB_PATH, ORS_API_KEY, provider=provider, time_policy=TSP_TIME_POLICY)
+        else:
+            VRP(DB_PATH, ORS_API_KEY, capacity=6, use_clusters=(PLANNING_MODE == "vrp"), provider=provider)
+
+    stages = [
+        ("geocode_appointments", "📍 Géocodage des adresses", lambda: geocode_appointments(DB_PATH, ORS_API_KEY)),
+        ("geocode_depots", "📍 Géocodage des dépôts", lambda: geocode_depots(DB_PATH, ORS_API_KEY)),
+    ]
+    if PLANNING_MODE != "vrp-global":
+        stages.append(("clustering", "🔗 Regroupement par proximité", lambda: clustering(
+            DB_PATH, capacity=6, max_distance_km=30, verbose=True, method=CLUSTERING_METHOD
+        )))
+    stages.append(("planning", "🛣️ Ordonner les itinéraires", plan))
+    return stages
+
+
 if st.button("🚀 Lancer l'optimisation des RDV"):
     print("\n##############\n")
+    job_id, started = submit_job(DB_PATH, JOB_KIND, optimisation_stages())
+    if not started:
+        st.warning("⏳ Une optimisation est déjà en cours.")
+    st.session_state["watched_job"] = job_id
+
+conn = ui_connection(DB_PATH)  # pool partagé, schéma migré à sa création
+try:
+    job = latest_job(conn, JOB_KIND)
+finally:
+    conn.close()
+running = job is not None and job["status"] == "running"
+
+
+@st.fragment(run_every="2s" if running else None)
+def job_progress():
+    """Avancement du dernier job, rafraîchi toutes les 2 s tant qu'il tourne."""
+    job_conn = ui_connection(DB_PATH)
     try:
-        st.info("📍 Géocodage des adresses...")
-        geocode_appointments(DB_PATH, ORS_API_KEY)
-
-        st.info("📍 Géocodage des dépôts...")
-        geocode_depots(DB_PATH, ORS_API_KEY)
-
-        st.info("🔗 Regroupement par proximité...")
-        clustering(DB_PATH, capacity=6, max_distance_km=30, verbose=True)
-
-        st.info("🛣️ Ordonner les itinéraires...")
-        TSP(DB_PATH, ORS_API_KEY)
-
-        st.success("✅ Optimisation terminée !")
+        job = latest_job(job_conn, JOB_KIND)
+    finally:
+        job_conn.close()
+    if job is None:
+        return
+
+    done = sum(stage["status"] == "done" for stage in job["stages"])
+    if job["status"] == "running":
+        st.progress(done / len(job["stages"]), text=f"Optimisation en cours ({done}/{len(job['stages'])})")
+    for stage in job["stages"]:
+        icon = {"done": "✅", "running": "⏳", "failed": "❌"}.get(stage["status"], "▫️")
+        duration = f" — {stage['duration_s']:.1f} s" if stage["duration_s"] is not None else ""
+        st.markdown(f"{icon} {stage['label']}{duration}")
+
+    if job["status"] == "failed":
+        st.error(f"❌ Une erreur est survenue : {job['error']}")
+    elif job["status"] == "done":
+        st.success(f"✅ Optimisation terminée ({job['finished_at']})")
+
+    # Fin du job suivi : rechargement complet pour afficher les nouveaux itinéraires
+    if job["status"] != "running" and st.session_state.get("watched_job") == job["id"]:
+        st.session_state["watched_job"] = None
         st.rerun()
 
-    except Exception as e:
-        st.error(f"❌ Une erreur est survenue : {e}")
+
+job_progress()
 
 # --------------------------------------------------
 # 3. Visualiser les clusters & itinéraires
 # --------------------------------------------------
-c.execute("SELECT COUNT(*) FROM itineraries")
-count_itin = c.fetchone()[0]
+clusters = load_itinerary_clusters(DB_PATH)
 
-if count_itin > 0:
+if clusters:
     st.subheader("📊 Résultats des clusters")
 
-    # Charger clusters disponibles
-    c.execute("""
-        SELECT DISTINCT i.cluster_id, c.cluster_name
-        FROM itineraries i
-        JOIN clusters c ON i.cluster_id = c.id
-    """)
-    clusters = c.fetchall()
-
-    if clusters:
-        cluster_choice = st.selectbox(
-            "Choisir un cluster à afficher :",
-            options=[name for _, name in clusters]
-        )
-        cluster_id = next(cid for cid, name in clusters if name == cluster_choice)
-
-        # Récupération itinéraire + RDV associés
-        c.execute("""
-            SELECT i.appt_id, i.sequence, i.depart_time, i.arrive_time,
-                   i.duration_visit, i.travel_time_prev, i.distance_prev,
-                   a.client_id, a.type, a.duration,
-                   a.num, a.rue, a.ville, a.zip,
-                   cl.nom as client_nom, cl.address as client_address
-            FROM itineraries i
-            LEFT JOIN appointments a ON i.appt_id = a.id
-            LEFT JOIN clients cl ON a.client_id = cl.id
-            WHERE i.cluster_id = ?
-            ORDER BY i.sequence
-        """, (cluster_id,))
-        rows = c.fetchall()
-
-        travels: list[Travel] = []
-        prev_appt: Appointment | None = None
-
-        for row in rows:
-            appt_id = row["appt_id"]
-
-            appt = None
-            if appt_id:  # construire l’objet Appointment + Client
-                client = Client(
-                    id=row["client_id"],
-                    nom=row["client_nom"],
-                    address=row["client_address"]
-                )
-                adresse = f"{row['num']} {row['rue']}, {row['ville']} {row['zip']}"
-                appt = Appointment(
-                    id=appt_id,
-                    client_id=client.id,
-                    num=row["num"], rue=row["rue"], ville=row["ville"], zip=row["zip"],
-                    type=row["type"], duration=row["duration"]
-                )
-                appt.client = client  # lien objet, non DB
-
-            travel = Travel(
-                origin_appt_id=prev_appt.id if prev_appt else None,
-                dest_appt_id=appt.id if appt else None,
-                cluster_id=cluster_id,
-                depart_time=row["depart_time"],
-                arrive_time=row["arrive_time"],
-                travel_time=row["travel_time_prev"],
-                distance=row["distance_prev"]
-            )
-            # enrichissement pour l'affichage
-            travel.seq = row["sequence"]
-            travel.duration_visit = row["duration_visit"]
-            travel.origin = prev_appt
-            travel.destination = appt
+    cluster_choice = st.selectbox(
+        "Choisir un cluster à afficher :",
+        options=[name for _, name in clusters]
+    )
+    cluster_id = next(cid for cid, name in clusters if name == cluster_choice)
 
-            travels.append(travel)
-            prev_appt = appt
+    # Récupération itinéraire + RDV associés (cache)
+    rows = load_cluster_itinerary(DB_PATH, cluster_id)
 
-        # --- Affichage ---
-        st.subheader("🕒 Planning du cluster")
+    travels = build_travels(cluster_id, rows)
 
-        for travel in travels[1:]:
-            prev_label = f"RDV {travel.origin.id}" if travel.origin else traveler_choice
-            curr_label = f"RDV {travel.destination.id}" if travel.destination else traveler_choice
+    # --- Carte du seul cluster affiché (artefact GeoJSON en cache) ---
+    st.subheader("🗺️ Carte du cluster")
+    geojson = load_cluster_route(DB_PATH, cluster_id, map_provider(), MAP_CACHE_DIR)
+    if geojson:
+        st_folium(cluster_map(geojson), height=450, use_container_width=True, returned_objects=[],
+                  key=f"cluster_map_{cluster_id}")
 
-            st.markdown(
-                f"**{travel.seq}.** {prev_label} → {curr_label}  \n"
-                f"🕒 Départ : {fmt_time_iso(travel.depart_time)}  •  Arrivée : {fmt_time_iso(travel.arrive_time)}  \n"
-                f"🚗 {travel.travel_time} min  |  📏 {travel.distance:.1f} km"
-            )
+    # --- Affichage ---
+    st.subheader("🕒 Planning du cluster")
 
+    for travel in travels[1:]:
+        prev_label = f"RDV {travel.origin.id}" if travel.origin else traveler_choice
+        curr_label = f"RDV {travel.destination.id}" if travel.destination else traveler_choice
+
+        st.markdown(
+            f"**{travel.seq}.** {prev_label} → {curr_label}  \n"
+            f"🕒 Départ : {fmt_time_iso(travel.depart_time)}  •  Arrivée : {fmt_time_iso(travel.arrive_time)}  \n"
+            f"🚗 {travel.travel_time} min  |  📏 {travel.distance:.1f} km"
+        )
 
-            if travel.destination:
-                appt = travel.destination
-                st.markdown("---")
-                st.markdown(
-                    f"👤 Client : **{appt.client.nom}**  \n"
-                    f"📍 Adresse : {appt.num} {appt.rue}, {appt.ville} {appt.zip}  \n"
-                    f"🏷️ Type : {appt.type or 'N/A'}  \n"
-                    f"⏱️ Durée prévue : {appt.duration} min"
-                )
-                st.markdown("---")
 
-    else:
-        st.info("ℹ️ Aucun cluster n'a encore été généré.")
+        if travel.destination:
+            appt = travel.destination
+            st.markdown("---")
+            st.markdown(
+                f"👤 Client : **{appt.client.nom}**  \n"
+                f"📍 Adresse : {appt.num} {appt.rue}, {appt.ville} {appt.zip}  \n"
+                f"🏷️ Type : {appt.type or 'N/A'}  \n"
+                f"⏱️ Durée prévue : {appt.duration} min"
+            )
+            st.markdown("---")
 
-conn.close()
+else:
+    st.info("ℹ️ Aucun cluster n'a encore été généré.")
@@ -1,40 +1,151 @@
 import sqlite3
-from dataclasses import dataclass, fields, asdict
-from typing import Optional, List, Type, TypeVar, Any
+from contextlib import contextmanager
+from operator import itemgetter
+from dataclasses import dataclass, fields
+from typing import Optional, List, Type, TypeVar, Any, Iterable, Iterator
 
 T = TypeVar("T")  # Type générique pour les dataclasses
 
+# Colonnes SQL par classe (hors clé primaire), calculées une seule fois
+_COLUMNS = {}
+# Champs lus depuis la base par classe (clé primaire incluse)
+_FIELDS = {}
+# Lecteurs de lignes par (classe, colonnes du curseur)
+_ROW_READERS = {}
+# Profondeur de BaseModel.transaction par connexion (id(conn) -> niveau)
+_TX_DEPTH = {}
+
+
+def _commit(conn: sqlite3.Connection) -> None:
+    """Commit, sauf à l'intérieur d'un bloc BaseModel.transaction (commit différé)."""
+    if not _TX_DEPTH.get(id(conn)):
+        conn.commit()
+
 
 class BaseModel:
     table: str   # Nom de la table (doit être défini dans chaque classe)
     pk: str = "id"  # Nom de la clé primaire (par défaut: id)
 
+    @classmethod
+    def columns(cls) -> List[str]:
+        """Colonnes de la table (champs du dataclass hors clé primaire et `table`)."""
+        cols = _COLUMNS.get(cls)
+        if cols is None:
+            cols = [f.name for f in fields(cls) if f.name not in (cls.pk, "table")]
+            _COLUMNS[cls] = cols
+        return cols
+
+    @staticmethod
+    @contextmanager
+    def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+        """
+        Regroupe les écritures (save, delete, bulk_*) dans une seule transaction :
+        commit à la sortie du bloc le plus externe, rollback en cas d'erreur.
+        Le bloc externe prend le verrou d'écriture dès l'entrée (BEGIN IMMEDIATE).
+        """
+        key = id(conn)
+        depth = _TX_DEPTH.get(key, 0)
+        if depth == 0 and not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        _TX_DEPTH[key] = depth + 1
+        try:
+            yield conn
+            if depth == 0:
+                conn.commit()
+        except BaseException:
+            if depth == 0:
+                conn.rollback()
+            raise
+        finally:
+            if depth == 0:
+                _TX_DEPTH.pop(key, None)
+            else:
+                _TX_DEPTH[key] = depth
+
+    @classmethod
+    def field_names(cls) -> List[str]:
+        """Champs persistés (clé primaire incluse, hors `table`), dans l'ordre du dataclass."""
+        names = _FIELDS.get(cls)
+        if names is None:
+            names = _FIELDS[cls] = [f.name for f in fields(cls) if f.name != "table"]
+        return names
+
+    @classmethod
+    def _row_reader(cls, keys: tuple):
+        """
+        (noms, extracteur) pour des lignes dont les colonnes sont `keys` :
+        l'extracteur renvoie, par position, les valeurs des champs présents dans l'ordre de field_names().
+        """
+        reader = _ROW_READERS.get((cls, keys))
+        if reader is None:
+            position = {k: i for i, k in enumerate(keys)}
+            names = tuple(name for name in cls.field_names() if name in position)
+            idx = [position[name] for name in names]
+            if len(idx) > 1:
+                getter = itemgetter(*idx)
+            elif idx:
+                getter = lambda row, i=idx[0]: (row[i],)
+            else:
+                getter = lambda row: ()
+            reader = _ROW_READERS[(cls, keys)] = (names, getter)
+        return reader
+
     @classmethod
     def from_row(cls: Type[T], row: sqlite3.Row) -> T:
         """Crée un objet dataclass depuis un row SQLite"""
-        kwargs = {f.name: row[f.name] for f in fields(cls) if f.name in row.keys()}
-        return cls(**kwargs)
+        names, getter = cls._row_reader(tuple(row.keys()))
+        return cls(**dict(zip(names, getter(row))))
+
+    @classmethod
+    def from_values(cls: Type[T], values: Iterable[Any]) -> T:
+        """Crée un objet depuis un tuple ordonné comme field_names()."""
+        return cls(**dict(zip(cls.field_names(), values)))
 
     @classmethod
     def get_by_id(cls: Type[T], conn: sqlite3.Connection, id_: int) -> Optional[T]:
+        return next(cls.where(conn, f"{cls.pk} = ?", (id_,)), None)
+
+    @classmethod
+    def where(cls: Type[T], conn: sqlite3.Connection, clause: Optional[str] = None, params: Iterable[Any] = (),
+              order_by: Optional[str] = None, batch_size: int = 500, as_tuple: bool = False) -> Iterator[T]:
+        """
+        Itère paresseusement sur les lignes vérifiant `clause` (SQL, paramètres `params`),
+        lues par paquets de batch_size (fetchmany). Le mapping colonnes → champs est
+        calculé une fois par requête, pas par ligne.
+        as_tuple=True : tuples de valeurs ordonnés comme field_names() (champs présents
+        dans la table), sans construction d'objet ; cf. from_values.
+        """
+        sql = f"SELECT * FROM {cls.table}"
+        if clause:
+            sql += f" WHERE {clause}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
         c = conn.cursor()
-        c.execute(f"SELECT * FROM {cls.table} WHERE {cls.pk} = ?", (id_,))
-        row = c.fetchone()
-        return cls.from_row(row) if row else None
+        c.row_factory = None  # tuples bruts, plus rapides que sqlite3.Row
+        c.execute(sql, tuple(params))
+        names, getter = cls._row_reader(tuple(d[0] for d in c.description))
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                values = getter(row)
+                yield values if as_tuple else cls(**dict(zip(names, values)))
+
+    @classmethod
+    def iter_all(cls: Type[T], conn: sqlite3.Connection, batch_size: int = 500, as_tuple: bool = False) -> Iterator[T]:
+        """Toutes les lignes de la table, en flux."""
+        return cls.where(conn, batch_size=batch_size, as_tuple=as_tuple)
 
     @classmethod
     def all(cls: Type[T], conn: sqlite3.Connection) -> List[T]:
-        c = conn.cursor()
-        c.execute(f"SELECT * FROM {cls.table}")
-        rows = c.fetchall()
-        return [cls.from_row(row) for row in rows]
+        return list(cls.iter_all(conn))
 
     def save(self, conn: sqlite3.Connection) -> None:
         """Insert ou Update selon que l'objet a déjà un id ou pas"""
         c = conn.cursor()
-        data = asdict(self)
-        cols = [f.name for f in fields(self) if f.name != self.pk]
-        vals = [data[col] for col in cols]
+        cols = self.columns()
+        vals = [getattr(self, col) for col in cols]
 
         if getattr(self, self.pk) is None:  # INSERT
             placeholders = ", ".join("?" for _ in cols)
@@ -50,7 +161,7 @@ class BaseModel:
                 vals + [getattr(self, self.pk)]
             )
 
-        conn.commit()
+        _commit(conn)
 
     def delete(self, conn: sqlite3.Connection) -> None:
         c = conn.cursor()
@@ -58,4 +169,62 @@ class BaseModel:
             f"DELETE FROM {self.table} WHERE {self.pk} = ?",
             (getattr(self, self.pk),)
         )
-        conn.commit()
+        _commit(conn)
+
+    # ------------------------------------------------------------
+    # Écritures groupées : une requête préparée, un seul commit
+    # ------------------------------------------------------------
+
+    @classmethod
+    def bulk_insert(cls, conn: sqlite3.Connection, objs: Iterable[T]) -> List[T]:
+        """
+        Insère tous les objets en une transaction.
+        Les objets sans id reçoivent l'id attribué par SQLite.
+        """
+        objs = list(objs)
+        if not objs:
+            return objs
+        cols = cls.columns()
+        with_pk = [o for o in objs if getattr(o, cls.pk) is not None]
+        without_pk = [o for o in objs if getattr(o, cls.pk) is None]
+
+        with cls.transaction(conn):
+            c = conn.cursor()
+            if with_pk:
+                all_cols = [cls.pk] + cols
+                c.executemany(
+                    f"INSERT INTO {cls.table} ({', '.join(all_cols)}) VALUES ({', '.join('?' for _ in all_cols)})",
+                    [[getattr(o, col) for col in all_cols] for o in with_pk],
+                )
+            if without_pk:
+                # Id lu après chaque insertion (exact aussi pour AUTOINCREMENT ou écrivains concurrents)
+                sql = f"INSERT INTO {cls.table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+                for o in without_pk:
+                    c.execute(sql, [getattr(o, col) for col in cols])
+                    setattr(o, cls.pk, c.lastrowid)
+        return objs
+
+    @classmethod
+    def bulk_update(cls, conn: sqlite3.Connection, objs: Iterable[T], columns: Optional[List[str]] = None) -> int:
+        """Met à jour les objets (toutes les colonnes ou `columns`) en une transaction."""
+        objs = list(objs)
+        if not objs:
+            return 0
+        cols = columns or cls.columns()
+        set_clause = ", ".join(f"{col} = ?" for col in cols)
+        with cls.transaction(conn):
+            conn.executemany(
+                f"UPDATE {cls.table} SET {set_clause} WHERE {cls.pk} = ?",
+                [[getattr(o, col) for col in cols] + [getattr(o, cls.pk)] for o in objs],
+            )
+        return len(objs)
+
+    @classmethod
+    def bulk_delete(cls, conn: sqlite3.Connection, objs_or_ids: Iterable[Any]) -> int:
+        """Supprime des objets (ou des ids) en une transaction."""
+        ids = [getattr(o, cls.pk) if isinstance(o, BaseModel) else o for o in objs_or_ids]
+        if not ids:
+            return 0
+        with cls.transaction(conn):
+            conn.executemany(f"DELETE FROM {cls.table} WHERE {cls.pk} = ?", [(i,) for i in ids])
+        return len(ids)
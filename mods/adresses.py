@@ -0,0 +1,163 @@
+import pandas as pd
+
+# ============================================================
+# Import en masse des rendez-vous (page Adresses)
+# ============================================================
+
+CSV_COLUMNS = ["Client", "Num", "Rue", "Ville", "Zip", "Type"]
+CSV_CHUNKSIZE = 10_000
+
+
+def full_address(num, rue, ville, zip_code):
+    """Adresse complète d'un RDV, au format de clients.address / locations.address."""
+    return f"{num} {rue}, {ville} {zip_code}"
+
+
+def _resolve_client_ids(c):
+    """(nom, adresse) -> id pour les clients de la table temporaire import_clients."""
+    c.execute("""
+        SELECT t.nom, t.address, MIN(cl.id)
+        FROM temp.import_clients t
+        JOIN clients cl ON cl.nom IS t.nom AND cl.address IS t.address  -- IS : noms vides (NULL) inclus
+        GROUP BY t.nom, t.address
+    """)
+    return {(nom, address): client_id for nom, address, client_id in c.fetchall()}
+
+
+def get_or_create_clients(conn, pairs):
+    """
+    Ids des clients (nom, adresse), créés s'ils n'existent pas, sans commit :
+    une jointure pour les existants, un executemany pour les nouveaux.
+    Retourne ({(nom, adresse): id}, nb de clients créés).
+    """
+    pairs = list(dict.fromkeys(pairs))
+    c = conn.cursor()
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS import_clients (nom TEXT, address TEXT)")
+    c.execute("DELETE FROM temp.import_clients")
+    c.executemany("INSERT INTO temp.import_clients (nom, address) VALUES (?, ?)", pairs)
+
+    ids = _resolve_client_ids(c)
+    missing = [pair for pair in pairs if pair not in ids]
+    if missing:
+        c.executemany("INSERT INTO clients (nom, address) VALUES (?, ?)", missing)
+        ids = _resolve_client_ids(c)
+    return ids, len(missing)
+
+
+def import_appointments_chunk(conn, df):
+    """
+    Insère un bloc de RDV (colonnes CSV_COLUMNS) sans commit :
+    clients dédoublonnés dans pandas, ids existants résolus par une seule jointure,
+    clients manquants puis RDV insérés par executemany.
+    Retourne (nb de RDV, nb de clients créés).
+    """
+    df = df[CSV_COLUMNS].astype(object)
+    df = df.where(df.notna(), None)
+    text = df.fillna("").astype(str)
+    df["address"] = text["Num"] + " " + text["Rue"] + ", " + text["Ville"] + " " + text["Zip"]
+
+    clients = df[["Client", "address"]].drop_duplicates()
+    ids, n_created = get_or_create_clients(conn, clients.itertuples(index=False, name=None))
+
+    client_ids = [ids[key] for key in zip(df["Client"], df["address"])]
+    conn.executemany("""
+        INSERT INTO appointments (client_id, num, rue, ville, zip, type)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, zip(client_ids, df["Num"], df["Rue"], df["Ville"], df["Zip"], df["Type"]))
+    return len(df), n_created
+
+
+def import_appointments_csv(conn, source, chunksize=CSV_CHUNKSIZE):
+    """
+    Importe un CSV (colonnes CSV_COLUMNS) lu par blocs de `chunksize` lignes,
+    en une seule transaction (tout ou rien).
+    Retourne (nb de RDV, nb de clients créés) ; ValueError si des colonnes manquent.
+    """
+    total_appts = total_clients = 0
+    try:
+        for chunk in pd.read_csv(source, chunksize=chunksize, dtype=str):
+            missing_cols = [col for col in CSV_COLUMNS if col not in chunk.columns]
+            if missing_cols:
+                raise ValueError(f"Le CSV doit contenir les colonnes suivantes : {CSV_COLUMNS}")
+            n_appts, n_clients = import_appointments_chunk(conn, chunk)
+            total_appts += n_appts
+            total_clients += n_clients
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return total_appts, total_clients
+
+
+# ============================================================
+# Enregistrement des modifications du tableau (st.data_editor)
+# ============================================================
+
+# Colonne du tableau -> colonne de appointments
+EDITOR_COLUMNS = {"Num": "num", "Rue": "rue", "Ville": "ville", "Zip": "zip", "Type": "type"}
+ADDRESS_COLUMNS = ("Num", "Rue", "Ville", "Zip")
+
+
+def _clean(value):
+    return None if pd.isna(value) else value
+
+
+def apply_editor_changes(conn, df, delta):
+    """
+    Applique le delta de st.data_editor (edited_rows, added_rows, deleted_rows) au tableau
+    d'origine `df` (colonnes id + CSV_COLUMNS) en une transaction :
+    - mises à jour regroupées par ensemble de colonnes modifiées (un executemany par groupe) ;
+    - changement de client : client (nom, adresse) retrouvé ou créé en une passe ;
+    - géocodes (locations) supprimés seulement pour les RDV dont l'adresse a changé ou supprimés.
+    Retourne {"updated", "added", "deleted"}.
+    """
+    edited = delta.get("edited_rows", {})
+    added = delta.get("added_rows", [])
+    deleted_ids = [int(df.iloc[int(pos)]["id"]) for pos in delta.get("deleted_rows", [])]
+
+    # Lignes réellement modifiées : {appt_id: {colonne: nouvelle valeur}}
+    changes = {}
+    for pos, cols in edited.items():
+        row = df.iloc[int(pos)]
+        diff = {col: _clean(val) for col, val in cols.items() if col in CSV_COLUMNS and _clean(val) != _clean(row[col])}
+        if diff:
+            changes[int(row["id"])] = (row, diff)
+
+    # Clients à retrouver/créer pour les lignes dont le client change
+    new_clients = {}
+    for appt_id, (row, diff) in changes.items():
+        if "Client" in diff:
+            final = {col: diff.get(col, _clean(row[col])) for col in ADDRESS_COLUMNS}
+            new_clients[appt_id] = (diff["Client"], full_address(final["Num"], final["Rue"], final["Ville"], final["Zip"]))
+
+    groups = {}
+    try:
+        client_ids, _ = get_or_create_clients(conn, new_clients.values()) if new_clients else ({}, 0)
+        for appt_id, (row, diff) in changes.items():
+            values = {EDITOR_COLUMNS[col]: val for col, val in diff.items() if col in EDITOR_COLUMNS}
+            if appt_id in new_clients:
+                values["client_id"] = client_ids[new_clients[appt_id]]
+            key = tuple(sorted(values))
+            groups.setdefault(key, []).append([values[col] for col in key] + [appt_id])
+
+        for cols, params in groups.items():
+            set_clause = ", ".join(f"{col} = ?" for col in cols)
+            conn.executemany(f"UPDATE appointments SET {set_clause} WHERE id = ?", params)
+
+        # Adresse modifiée : géocode supprimé, le RDV est regéocodé comme un nouveau au prochain lancement
+        moved = [(appt_id,) for appt_id, (_, diff) in changes.items() if any(col in diff for col in ADDRESS_COLUMNS)]
+        conn.executemany("DELETE FROM locations WHERE appt_id = ?", moved)
+
+        if deleted_ids:
+            conn.executemany("DELETE FROM locations WHERE appt_id = ?", [(i,) for i in deleted_ids])
+            conn.executemany("DELETE FROM appointments WHERE id = ?", [(i,) for i in deleted_ids])
+
+        if added:
+            rows = pd.DataFrame(added).reindex(columns=CSV_COLUMNS)
+            import_appointments_chunk(conn, rows)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"updated": len(changes), "added": len(added), "deleted": len(deleted_ids)}
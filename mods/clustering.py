@@ -1,8 +1,154 @@
-import sqlite3
-from geopy.distance import geodesic
+import numpy as np
+from sklearn.neighbors import BallTree
 
-def clustering(db_path, capacity=6, max_distance_km=30, verbose=True):
-    conn = sqlite3.connect(db_path)
+from mods.db import get_connection
+from mods.profiling import count, timer
+from mods.distance import EARTH_RADIUS_KM, distances_from, haversine_km
+
+CLUSTERING_METHODS = ("chain", "sweep", "kmeans", "agglomerative")
+
+
+# ============================================================
+# Moteurs de regroupement
+# Chaque moteur reçoit les coordonnées (degrés) et renvoie une liste
+# de groupes d'indices, chacun de taille <= capacity.
+# ============================================================
+
+def chain_groups(lats, lons, depot_dist, capacity, max_distance_km):
+    """Historique : tri par distance au dépôt, coupure sur saut de distance ou capacité."""
+    order = np.argsort(depot_dist, kind="stable")
+    step_dist = haversine_km(lats[order][:-1], lons[order][:-1], lats[order][1:], lons[order][1:], ellipsoid=True)
+
+    groups, current = [], []
+    for k, idx in enumerate(order):
+        if k > 0 and (step_dist[k - 1] > max_distance_km or len(current) >= capacity):
+            groups.append(current)
+            current = []
+        current.append(int(idx))
+    if current:
+        groups.append(current)
+    return groups
+
+
+def sweep_groups(lats, lons, depot_lat, depot_lon, capacity):
+    """
+    Balayage angulaire autour du dépôt (O(n log n)).
+    Le balayage démarre dans le plus grand secteur vide pour ne pas couper un groupe naturel.
+    """
+    dx = (lons - depot_lon) * np.cos(np.radians(depot_lat))
+    dy = lats - depot_lat
+    angles = np.arctan2(dy, dx)
+    order = np.argsort(angles, kind="stable")
+    if len(order) > 1:
+        sorted_angles = angles[order]
+        gaps = np.diff(np.concatenate([sorted_angles, sorted_angles[:1] + 2 * np.pi]))
+        order = np.roll(order, -int((np.argmax(gaps) + 1) % len(order)))
+    return [order[i:i + capacity].tolist() for i in range(0, len(order), capacity)]
+
+
+def kmeans_groups(lats, lons, capacity, n_iter=10, random_state=0):
+    """
+    K-means sous contrainte de capacité : k = ceil(n / capacity) centres,
+    affectation gloutonne par regret (écart 1er/2e centre) aux centres non pleins,
+    les centres voisins étant trouvés via un BallTree.
+    """
+    n = len(lats)
+    k = int(np.ceil(n / capacity))
+    pts = np.radians(np.column_stack([lats, lons]))
+    if k <= 1:
+        return [list(range(n))]
+
+    rng = np.random.default_rng(random_state)
+    centers = pts[rng.choice(n, size=k, replace=False)]
+    labels = np.full(n, -1)
+
+    n_candidates = min(k, 16)
+    for _ in range(n_iter):
+        tree = BallTree(centers, metric="haversine")
+        dist, nearest = tree.query(pts, k=n_candidates)  # centres voisins triés par distance
+        regret = dist[:, 1] - dist[:, 0] if n_candidates > 1 else dist[:, 0]
+        load = np.zeros(k, dtype=int)
+        new_labels = np.full(n, -1)
+        for i in np.argsort(-regret, kind="stable"):
+            for center in nearest[i]:
+                if load[center] < capacity:
+                    break
+            else:
+                # Tous les centres voisins sont pleins : plus proche centre non plein
+                free = np.flatnonzero(load < capacity)
+                center = free[np.argmin(haversine_km(
+                    lats[i], lons[i], np.degrees(centers[free, 0]), np.degrees(centers[free, 1])
+                ))]
+            new_labels[i] = center
+            load[center] += 1
+
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        centers = np.array([
+            pts[labels == j].mean(axis=0) if np.any(labels == j) else centers[j]
+            for j in range(k)
+        ])
+
+    return [np.flatnonzero(labels == j).tolist() for j in range(k) if np.any(labels == j)]
+
+
+def agglomerative_groups(lats, lons, capacity, max_distance_km, n_neighbors=8):
+    """
+    Agglomération à lien simple sous contrainte de capacité (type Kruskal) :
+    arêtes des k plus proches voisins (BallTree) triées par longueur, fusion
+    si la taille cumulée reste <= capacity et l'arête <= max_distance_km.
+    """
+    n = len(lats)
+    pts = np.radians(np.column_stack([lats, lons]))
+    k = min(n_neighbors + 1, n)
+    dist, neigh = BallTree(pts, metric="haversine").query(pts, k=k)
+    dist_km = dist[:, 1:] * EARTH_RADIUS_KM
+
+    src = np.repeat(np.arange(n), k - 1)
+    dst = neigh[:, 1:].ravel()
+    edges_km = dist_km.ravel()
+    order = np.argsort(edges_km, kind="stable")
+
+    parent = np.arange(n)
+    size = np.ones(n, dtype=int)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for e in order:
+        if edges_km[e] > max_distance_km:
+            break
+        a, b = find(src[e]), find(dst[e])
+        if a == b or size[a] + size[b] > capacity:
+            continue
+        if size[a] < size[b]:
+            a, b = b, a
+        parent[b] = a
+        size[a] += size[b]
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+# ============================================================
+# Point d'entrée
+# ============================================================
+
+def clustering(db_path, capacity=6, max_distance_km=30, verbose=True, method="chain"):
+    """
+    Regroupe les rendez-vous géocodés en paquets ("Jour N") de au plus `capacity` RDV.
+    method : "chain" (historique), "sweep", "kmeans" ou "agglomerative".
+    """
+    if method not in CLUSTERING_METHODS:
+        raise ValueError(f"Méthode de clustering inconnue : {method} ({', '.join(CLUSTERING_METHODS)})")
+
+    conn = get_connection(db_path)
     c = conn.cursor()
 
     # Récupérer le dépôt
@@ -19,6 +165,7 @@ def clustering(db_path, capacity=6, max_distance_km=30, verbose=True):
         SELECT a.id, l.lat, l.lon
         FROM appointments a
         JOIN locations l ON a.id = l.appt_id
+        WHERE l.lat IS NOT NULL AND l.lon IS NOT NULL
     """)
     points = c.fetchall()  # [(appt_id, lat, lon), ...]
 
@@ -27,39 +174,34 @@ def clustering(db_path, capacity=6, max_distance_km=30, verbose=True):
         conn.close()
         return
 
-    # Calculer distance au dépôt
-    points_with_dist = [
-        (appt_id, lat, lon, geodesic((depot_lat, depot_lon), (lat, lon)).km)
-        for appt_id, lat, lon in points
-    ]
+    # Calculer distance au dépôt (vectorisé, ellipsoïde WGS84)
+    lats = np.array([p[1] for p in points], dtype=float)
+    lons = np.array([p[2] for p in points], dtype=float)
+    depot_dist = distances_from(depot_lat, depot_lon, lats, lons, ellipsoid=True)
+
+    if method == "chain":
+        groups = chain_groups(lats, lons, depot_dist, capacity, max_distance_km)
+    elif method == "sweep":
+        groups = sweep_groups(lats, lons, depot_lat, depot_lon, capacity)
+    elif method == "kmeans":
+        groups = kmeans_groups(lats, lons, capacity)
+    else:
+        groups = agglomerative_groups(lats, lons, capacity, max_distance_km)
 
-    # Trier par distance au dépôt
-    points_with_dist.sort(key=lambda x: x[3])
+    # Jours numérotés du plus proche au plus éloigné du dépôt ("chain" est déjà dans cet ordre)
+    if method != "chain":
+        groups.sort(key=lambda g: float(np.mean(depot_dist[g])))
 
     # Supprimer anciens clusters
     c.execute("DELETE FROM clusters;")
 
-     # Créer les clusters sous forme de dictionnaire
+    # Créer les clusters sous forme de dictionnaire
     clusters = {}
-    current_cluster = []
-    current_cluster_name = 1
-    prev_point = None
-
-    for appt_id, lat, lon, dist in points_with_dist:
-        if prev_point is not None:
-            dist_to_prev = geodesic((prev_point[1], prev_point[2]), (lat, lon)).km
-            if dist_to_prev > max_distance_km or len(current_cluster) >= capacity:
-                if current_cluster:
-                    clusters[f"Jour {current_cluster_name}"] = current_cluster
-                    current_cluster_name += 1
-                    current_cluster = []
-
-        current_cluster.append((appt_id, lat, lon, dist))
-        prev_point = (appt_id, lat, lon, dist)
-
-    # Ajouter le dernier cluster
-    if current_cluster:
-        clusters[f"Jour {current_cluster_name}"] = current_cluster
+    for num, group in enumerate(groups, start=1):
+        group = sorted(group, key=lambda i: depot_dist[i])
+        clusters[f"Jour {num}"] = [
+            (points[i][0], points[i][1], points[i][2], float(depot_dist[i])) for i in group
+        ]
 
     # Sauvegarde en DB et affichage
     for cluster_name, cluster_points in clusters.items():
@@ -67,12 +209,17 @@ def clustering(db_path, capacity=6, max_distance_km=30, verbose=True):
             print(f"\n{cluster_name} → {len(cluster_points)} RDV(s)")
             for appt_id, lat, lon, dist in cluster_points:
                 print(f"  RDV {appt_id} | {dist:.2f} km du dépôt | coords: ({lat:.5f}, {lon:.5f})")
-        for appt_id, lat, lon, dist in cluster_points:
-            c.execute("""
-                INSERT INTO clusters (cluster_name, appt_id)
-                VALUES (?, ?)
-            """, (cluster_name, appt_id))
+    with timer("db.clusters"):
+        c.executemany("""
+            INSERT INTO clusters (cluster_name, appt_id)
+            VALUES (?, ?)
+        """, [
+            (cluster_name, appt_id)
+            for cluster_name, cluster_points in clusters.items()
+            for appt_id, _, _, _ in cluster_points
+        ])
 
-    conn.commit()
+        conn.commit()
     conn.close()
-    print(f"* Clustering terminé → {len(clusters)} paquets créés")
+    count("rows.clusters", sum(len(points) for points in clusters.values()))
+    print(f"* Clustering terminé ({method}) → {len(clusters)} paquets créés")
@@ -0,0 +1,151 @@
+import os
+import queue
+import sqlite3
+import threading
+
+# ============================================================
+# Connexions SQLite partagées
+# WAL : les lecteurs (pages Streamlit) ne sont plus bloqués pendant
+# qu'un traitement (TSP, géocodage...) écrit, et inversement.
+# ============================================================
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",      # sûr en WAL, fsync au checkpoint seulement
+    "PRAGMA mmap_size = 268435456",     # 256 Mo lus via mmap
+    "PRAGMA cache_size = -65536",       # 64 Mo de cache de pages par connexion
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Connexions inactives conservées par pool (au-delà, close() ferme réellement)
+POOL_SIZE = 8
+BUSY_TIMEOUT_S = 30
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connexion dont close() la rend au pool au lieu de la fermer."""
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def close_for_real(self):
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Pool de connexions configurées (PRAGMAS) vers une base.
+    acquire() ne bloque jamais : une connexion inactive ou une nouvelle.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path, timeout=BUSY_TIMEOUT_S, factory=PooledConnection, check_same_thread=False
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()  # écriture non validée par l'appelant
+        except sqlite3.Error:
+            conn.close_for_real()
+            return
+        conn.row_factory = None
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close_for_real()
+
+    def close_all(self):
+        """Ferme les connexions inactives (avant suppression ou remplacement du fichier)."""
+        while True:
+            try:
+                self._idle.get_nowait().close_for_real()
+            except queue.Empty:
+                return
+
+
+# Un pool par (base, processus) : une connexion SQLite ne doit pas traverser un fork
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(db_path):
+    key = (os.path.abspath(db_path), os.getpid())
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = ConnectionPool(db_path)
+        return pool
+
+
+def get_connection(db_path):
+    """Connexion du pool de la base ; conn.close() la rend au pool."""
+    return get_pool(db_path).acquire()
+
+
+def checkpoint(db_path):
+    """Reporte le journal WAL dans le fichier principal (avant copie ou téléchargement de la base)."""
+    conn = get_connection(db_path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+def remove_database(db_path):
+    """Supprime la base et ses fichiers WAL, après fermeture des connexions du pool."""
+    get_pool(db_path).close_all()
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ============================================================
+# Interface Streamlit
+# ============================================================
+
+_ui_pool = None
+
+
+def _create_ui_pool(db_path):
+    from mods.migrations import migrate
+    pool = get_pool(db_path)
+    conn = pool.acquire()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+    return pool
+
+
+def ui_connection(db_path):
+    """
+    Connexion pour les pages Streamlit : pool partagé par toutes les sessions
+    (st.cache_resource), schéma migré une fois à sa création.
+    """
+    global _ui_pool
+    if _ui_pool is None:
+        import streamlit as st
+        _ui_pool = st.cache_resource(show_spinner=False)(_create_ui_pool)
+    return _ui_pool(db_path).acquire()
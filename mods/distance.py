@@ -0,0 +1,54 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088   # Rayon moyen (IUGG)
+WGS84_A_KM = 6378.137         # Demi-grand axe WGS84
+WGS84_F = 1 / 298.257223563   # Aplatissement WGS84
+
+
+def _central_angle(lat1, lon1, lat2, lon2):
+    """Angle au centre (radians) entre deux points en radians, formule de haversine."""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_km(lat1, lon1, lat2, lon2, ellipsoid=False):
+    """
+    Distance en km entre (lat1, lon1) et (lat2, lon2), en degrés.
+    Vectorisé : accepte des scalaires ou des tableaux NumPy (broadcasting).
+    ellipsoid=True : correction de Lambert sur l'ellipsoïde WGS84
+    (écart < 10 m avec geopy.geodesic sur des distances régionales).
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    if not ellipsoid:
+        return EARTH_RADIUS_KM * _central_angle(lat1, lon1, lat2, lon2)
+
+    # Formule de Lambert : latitudes réduites puis correction d'aplatissement
+    b1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    b2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sigma = _central_angle(b1, lon1, b2, lon2)
+    p = (b1 + b2) / 2
+    q = (b2 - b1) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(sigma / 2) ** 2
+        dist = WGS84_A_KM * (sigma - WGS84_F / 2 * (x + y))
+    return np.where(sigma > 0, dist, 0.0)
+
+
+def distances_from(lat, lon, lats, lons, ellipsoid=False):
+    """Distances (km) d'un point (dépôt) vers tous les points `lats`, `lons`."""
+    return haversine_km(lat, lon, lats, lons, ellipsoid=ellipsoid)
+
+
+def pairwise_km(lats, lons, lats2=None, lons2=None, ellipsoid=False):
+    """
+    Matrice des distances (km) entre tous les points, en un seul appel.
+    Sans second jeu de points : matrice carrée n x n.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    lats2 = lats if lats2 is None else np.asarray(lats2, dtype=float)
+    lons2 = lons if lons2 is None else np.asarray(lons2, dtype=float)
+    return haversine_km(lats[:, None], lons[:, None], lats2[None, :], lons2[None, :], ellipsoid=ellipsoid)
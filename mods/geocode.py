@@ -1,89 +1,347 @@
-import sqlite3,requests
+import requests,threading,time,re,unicodedata
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
+from mods.db import get_connection
+from mods.migrations import migrate
+from mods.profiling import bind, count, timed, timer
 
-def geocode_address(address, API_key, conn):
-    c = conn.cursor()
+ORS_GEOCODE_URL = "https://api.openrouteservice.org/geocode/search"
+
+# Quota ORS (plan gratuit) : 100 requêtes de géocodage par minute
+ORS_GEOCODE_RATE_PER_MIN = 100
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=8):
+    """Session HTTP partagée (keep-alive) pour tous les appels de géocodage."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+class TokenBucket:
+    """Limiteur de débit thread-safe : `rate_per_min` jetons par minute, rafale de `burst`."""
 
-    # Vérifier si déjà présent dans locations
-    c.execute("SELECT lat, lon FROM locations WHERE address = ? LIMIT 1", (address,))
-    row = c.fetchone()
-    if row:
-        return row[0], row[1]  # lat, lon
+    def __init__(self, rate_per_min=ORS_GEOCODE_RATE_PER_MIN, burst=None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = burst or max(1, int(rate_per_min // 6))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-    # Sinon appel API ORS
-    url = "https://api.openrouteservice.org/geocode/search"
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def fetch_geocode(address, API_key, session=None, limiter=None, base_url=ORS_GEOCODE_URL,
+                  max_retries=4, backoff_s=1.0):
+    """
+    Appel ORS geocode/search pour une adresse.
+    Réessaie avec backoff exponentiel sur 429/5xx et erreurs réseau.
+    Retourne (status, lat, lon) avec status :
+    - "ok"    : coordonnées trouvées
+    - "miss"  : ORS a répondu mais sans résultat (échec définitif, cacheable)
+    - "error" : échec réseau/HTTP (transitoire, à ne pas cacher)
+    """
+    session = session or get_session()
     params = {"api_key": API_key, "text": address, "size": 1}
-    response = requests.get(url, params=params)
-    data = response.json()
+
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        count("ors.geocode.requests")
+        try:
+            with timer("ors.geocode"):
+                response = session.get(base_url, params=params, timeout=30)
+        except requests.exceptions.RequestException as e:
+            if attempt == max_retries:
+                print(f"[X] Erreur réseau géocodage ({address}) : {e}")
+                return "error", None, None
+            time.sleep(backoff_s * 2 ** attempt)
+            continue
+
+        if response.status_code == 429 or response.status_code >= 500:
+            if attempt == max_retries:
+                print(f"[X] ORS HTTP {response.status_code} pour {address}")
+                return "error", None, None
+            retry_after = response.headers.get("Retry-After")
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = backoff_s * 2 ** attempt
+            time.sleep(delay)
+            continue
+        break
+
+    if not response.ok:
+        print(f"[X] ORS HTTP {response.status_code} pour {address}")
+        return "error", None, None
+
+    try:
+        data = response.json()
+    except ValueError:
+        return "error", None, None
 
     try:
         coords = data["features"][0]["geometry"]["coordinates"]
         lon, lat = coords
-        return lat, lon
-    except (KeyError, IndexError):
-        return None, None
+        return "ok", lat, lon
+    except (KeyError, IndexError, TypeError, ValueError):
+        return "miss", None, None
+
+
+def request_geocode(address, API_key, session=None, limiter=None, base_url=ORS_GEOCODE_URL,
+                    max_retries=4, backoff_s=1.0):
+    """Comme fetch_geocode, mais retourne (lat, lon) ou (None, None)."""
+    _, lat, lon = fetch_geocode(address, API_key, session, limiter, base_url, max_retries, backoff_s)
+    return lat, lon
+
+
+def geocode_batch(addresses, API_key, workers=4, rate_per_min=ORS_GEOCODE_RATE_PER_MIN,
+                  base_url=ORS_GEOCODE_URL, max_retries=4, with_status=False):
+    """
+    Géocode une liste d'adresses en parallèle (threads + session partagée),
+    en respectant le quota ORS via un token bucket commun.
+    Retourne {address: (lat, lon)} ((None, None) si échec),
+    ou {address: (status, lat, lon)} si with_status=True.
+    """
+    unique = list(dict.fromkeys(a for a in addresses if a))
+    if not unique:
+        return {}
+
+    session = get_session(pool_size=max(workers, 1))
+    limiter = TokenBucket(rate_per_min)
+
+    def work(address):
+        return address, fetch_geocode(address, API_key, session, limiter, base_url, max_retries)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        results = dict(pool.map(bind(work), unique))  # mesures rattachées au profil de l'appelant
+
+    if with_status:
+        return results
+    return {address: (lat, lon) for address, (_, lat, lon) in results.items()}
+
+
+# ============================================================
+# Cache de géocodage (clé = adresse normalisée)
+# ============================================================
+
+GEOCODE_CACHE_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        norm_key TEXT PRIMARY KEY,
+        address TEXT,
+        lat REAL,
+        lon REAL,
+        status TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_geocode_cache_status_updated ON geocode_cache (status, updated_at)",
+]
+
+# Durée de vie d'un échec de géocodage en cache (les succès n'expirent pas)
+NEGATIVE_TTL_DAYS = 7
 
+_POSTCODE_RE = re.compile(r"\b\d{5}\b")
 
-def geocode_appointments(db_path, api_key):
+
+def normalize_address(address):
+    """
+    Clé normalisée d'une adresse : minuscules, sans accents ni ponctuation,
+    espaces compactés, codes postaux déplacés en fin de clé.
+    "12 Rue de l'Église, Paris 75001" et "12 rue de l eglise,  75001 PARIS"
+    donnent la même clé.
+    """
+    if not address:
+        return ""
+    text = unicodedata.normalize("NFKD", str(address))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    postcodes = sorted(_POSTCODE_RE.findall(text))
+    text = _POSTCODE_RE.sub(" ", text)
+    tokens = [t for t in text.split() if t != "none"]
+    return " ".join(tokens + postcodes)
+
+
+def ensure_geocode_cache(conn):
+    """Crée la table geocode_cache et son index si besoin."""
+    for sql in GEOCODE_CACHE_SQL:
+        conn.execute(sql)
+
+
+@timed("db.geocode_cache")
+def cache_lookup(conn, addresses, negative_ttl_days=NEGATIVE_TTL_DAYS):
+    """
+    Cherche les adresses dans geocode_cache.
+    Retourne {address: (lat, lon)} ; les échecs encore valides donnent (None, None).
+    Les adresses absentes (ou échecs expirés) ne sont pas dans le résultat.
+    """
+    ensure_geocode_cache(conn)
+    keys = {}
+    for address in addresses:
+        if address:
+            keys.setdefault(normalize_address(address), []).append(address)
+    if not keys:
+        return {}
+
+    expiry = (datetime.now() - timedelta(days=negative_ttl_days)).isoformat(timespec="seconds")
+    found = {}
+    key_list = list(keys)
+    c = conn.cursor()
+    for start in range(0, len(key_list), 500):  # limite de variables SQLite
+        chunk = key_list[start:start + 500]
+        c.execute(f"""
+            SELECT norm_key, lat, lon, status, updated_at
+            FROM geocode_cache
+            WHERE norm_key IN ({", ".join("?" for _ in chunk)})
+        """, chunk)
+        for norm_key, lat, lon, status, updated_at in c.fetchall():
+            if status == "miss" and updated_at < expiry:
+                continue
+            for address in keys[norm_key]:
+                found[address] = (lat, lon) if status == "ok" else (None, None)
+    return found
+
+
+@timed("db.geocode_cache")
+def cache_store(conn, results):
+    """
+    Enregistre des résultats de géocodage.
+    results : {address: (status, lat, lon)} ; les erreurs transitoires sont ignorées.
+    """
+    ensure_geocode_cache(conn)
+    now = datetime.now().isoformat(timespec="seconds")
+    rows = [
+        (normalize_address(address), address, lat, lon, status, now)
+        for address, (status, lat, lon) in results.items()
+        if status in ("ok", "miss") and address
+    ]
+    conn.executemany("""
+        INSERT OR REPLACE INTO geocode_cache (norm_key, address, lat, lon, status, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+
+
+def geocode_cached(addresses, API_key, conn, workers=4, rate_per_min=ORS_GEOCODE_RATE_PER_MIN,
+                   base_url=ORS_GEOCODE_URL, negative_ttl_days=NEGATIVE_TTL_DAYS):
+    """
+    Géocode via le cache, puis en lot (geocode_batch) pour les adresses inconnues.
+    Retourne {address: (lat, lon)} ((None, None) si échec).
+    Les variantes d'une même adresse (même normalize_address) ne donnent qu'une requête.
+    """
+    coords = cache_lookup(conn, addresses, negative_ttl_days)
+    variants = {}  # clé normalisée -> adresses inconnues ; la première est envoyée à ORS
+    for address in dict.fromkeys(addresses):
+        if address and address not in coords:
+            variants.setdefault(normalize_address(address), []).append(address)
+    missing = [group[0] for group in variants.values()]
+    count("cache.geocode.hits", len(coords))
+    count("cache.geocode.misses", len(missing))
+    if missing:
+        print(f"  Cache géocodage : {len(coords)} trouvées, {len(missing)} à demander à ORS")
+        results = geocode_batch(missing, API_key, workers=workers, rate_per_min=rate_per_min,
+                                base_url=base_url, with_status=True)
+        cache_store(conn, results)
+        for group in variants.values():
+            _, lat, lon = results[group[0]]
+            coords.update({address: (lat, lon) for address in group})
+    return coords
+
+
+def geocode_address(address, API_key, conn):
+    """Retourne (lat, lon) d'une adresse, via geocode_cache puis ORS."""
+    return geocode_cached([address], API_key, conn).get(address, (None, None))
+
+
+def geocode_appointments(db_path, api_key, workers=4, rate_per_min=ORS_GEOCODE_RATE_PER_MIN,
+                         base_url=ORS_GEOCODE_URL):
     print("* Mise à jour des géocodes (lat, lon)")
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path)
     c = conn.cursor()
 
-    # Ajouter la colonne address si elle n’existe pas
-    try:
-        c.execute("ALTER TABLE locations ADD COLUMN address TEXT")
-    except sqlite3.OperationalError:
-        pass  # colonne existe déjà
+    migrate(conn, verbose=False)  # locations.address
 
-    # Récupérer tous les RDV
-    c.execute("SELECT id, num, rue, ville, zip FROM appointments")
+    # Récupérer tous les RDV et leur géocode actuel
+    c.execute("""
+        SELECT a.id, a.num, a.rue, a.ville, a.zip, l.appt_id, l.address
+        FROM appointments a
+        LEFT JOIN locations l ON l.appt_id = a.id
+    """)
     appointments = c.fetchall()
 
-    done, updated = 0, 0
-    for appt_id, num, rue, ville, zip_code in appointments:
+    to_insert, to_update = [], []
+    for appt_id, num, rue, ville, zip_code, loc_appt_id, loc_address in appointments:
         full_address = f"{num} {rue}, {ville} {zip_code}"
+        if loc_appt_id is None:
+            to_insert.append((appt_id, full_address))
+        elif loc_address != full_address:
+            to_update.append((appt_id, full_address))
+
+    # Adresses déjà connues dans geocode_cache → pas d'appel réseau
+    pending = [address for _, address in to_insert + to_update]
+    coords = geocode_cached(pending, api_key, conn, workers=workers,
+                            rate_per_min=rate_per_min, base_url=base_url)
 
-        # Vérifier si déjà en base
-        c.execute("SELECT address FROM locations WHERE appt_id = ?", (appt_id,))
-        row = c.fetchone()
-
-        if row:
-            # Si l'adresse a changé → mettre à jour
-            if row[0] != full_address:
-                lat, lon = geocode_address(full_address, api_key, conn)
-                if lat and lon:
-                    c.execute("""
-                        UPDATE locations 
-                        SET address = ?, lat = ?, lon = ?
-                        WHERE appt_id = ?
-                    """, (full_address, lat, lon, appt_id))
-                    print(f"~ Adresse mise à jour : {full_address} → {lat}, {lon}")
-                    updated += 1
-                else:
-                    print(f"[X] Mise à jour échouée pour {full_address}")
+    insert_rows, update_rows = [], []
+    for appt_id, full_address in to_insert:
+        lat, lon = coords.get(full_address, (None, None))
+        if lat and lon:
+            insert_rows.append((appt_id, full_address, lat, lon))
+            print(f"+ Nouvelle adresse : {full_address} → {lat}, {lon}")
+        else:
+            print(f"[X] Géocodage échoué pour {full_address}")
+    for appt_id, full_address in to_update:
+        lat, lon = coords.get(full_address, (None, None))
+        if lat and lon:
+            update_rows.append((full_address, lat, lon, appt_id))
+            print(f"~ Adresse mise à jour : {full_address} → {lat}, {lon}")
         else:
-            # Sinon → nouvel enregistrement
-            lat, lon = geocode_address(full_address, api_key, conn)
-            if lat and lon:
-                c.execute("""
-                    INSERT INTO locations (appt_id, address, lat, lon)
-                    VALUES (?, ?, ?, ?)
-                """, (appt_id, full_address, lat, lon))
-                print(f"+ Nouvelle adresse : {full_address} → {lat}, {lon}")
-                done += 1
-            else:
-                print(f"[X] Géocodage échoué pour {full_address}")
+            print(f"[X] Mise à jour échouée pour {full_address}")
 
-    conn.commit()
+    with timer("db.locations"):
+        c.executemany("""
+            INSERT INTO locations (appt_id, address, lat, lon)
+            VALUES (?, ?, ?, ?)
+        """, insert_rows)
+        c.executemany("""
+            UPDATE locations
+            SET address = ?, lat = ?, lon = ?
+            WHERE appt_id = ?
+        """, update_rows)
+
+        conn.commit()
     conn.close()
-    print(f"* {done} nouvelles adresses ajoutées, {updated} mises à jour.")
+    count("rows.locations", len(insert_rows) + len(update_rows))
+    print(f"* {len(insert_rows)} nouvelles adresses ajoutées, {len(update_rows)} mises à jour.")
 
-def geocode_depots(db_path, api_key):
-    conn = sqlite3.connect(db_path)
+def geocode_depots(db_path, api_key, workers=4, rate_per_min=ORS_GEOCODE_RATE_PER_MIN,
+                   base_url=ORS_GEOCODE_URL):
+    conn = get_connection(db_path)
     c = conn.cursor()
     c.execute("SELECT id, nom, num, rue, ville, zip, lat, lon FROM depots")
     rows = c.fetchall()
 
+    pending = []
     for row in rows:
         depot_id, nom, num, rue, ville, zip, lat, lon = row
 
@@ -93,15 +351,24 @@ def geocode_depots(db_path, api_key):
 
         # Construire adresse complète
         address = f"{num or ''} {rue or ''}, {zip or ''} {ville or ''}".strip()
-        if not address:
+        if not address.strip(", "):
             print(f"[!] Dépôt {nom} sans adresse complète, ignoré.")
             continue
+        pending.append((depot_id, nom, address))
 
-        lat, lon = geocode_address(address, api_key, conn)
+    coords = geocode_cached([address for _, _, address in pending], api_key, conn,
+                            workers=workers, rate_per_min=rate_per_min, base_url=base_url)
 
-        try:
-            c.execute("UPDATE depots SET lat = ?, lon = ? WHERE id = ?", (lat, lon, depot_id))
-            conn.commit()
-            print(f"[OK] Dépôt '{nom}' géocodé : {lat:.5f}, {lon:.5f}")
-        except (KeyError, IndexError):
+    updates = []
+    for depot_id, nom, address in pending:
+        lat, lon = coords.get(address, (None, None))
+        if lat is None or lon is None:
             print(f"[X] Impossible de géocoder le dépôt '{nom}'")
+            continue
+        updates.append((lat, lon, depot_id))
+        print(f"[OK] Dépôt '{nom}' géocodé : {lat:.5f}, {lon:.5f}")
+
+    c.executemany("UPDATE depots SET lat = ?, lon = ? WHERE id = ?", updates)
+    conn.commit()
+    conn.close()
+    count("rows.depots", len(updates))
@@ -0,0 +1,94 @@
+from itertools import groupby
+from operator import itemgetter
+
+from mods.models import Client, Appointment, Travel
+
+# ============================================================
+# Lecture des itinéraires
+# Une seule requête jointe et triée (itinéraires, coordonnées, dépôt,
+# RDV, client) lue en flux et regroupée par cluster : partagée par
+# la carte (mods.map_gen) et le planning de la page d'accueil.
+# ============================================================
+
+# Dépôt du cluster (VRP) ou, à défaut, premier dépôt (TSP) ; les étapes
+# sans RDV (départ/retour) prennent ses coordonnées.
+STOPS_SQL = """
+    SELECT i.cluster_id, cl.cluster_name, i.sequence, i.appt_id,
+           i.depart_time, i.arrive_time, i.duration_visit, i.travel_time_prev, i.distance_prev,
+           COALESCE(l.lat, d.lat) AS lat, COALESCE(l.lon, d.lon) AS lon,
+           d.id AS depot_id, d.lat AS depot_lat, d.lon AS depot_lon,
+           a.client_id, a.type, a.duration, a.num, a.rue, a.ville, a.zip,
+           c.nom AS client_nom, c.address AS client_address
+    FROM itineraries i
+    JOIN clusters cl ON cl.id = i.cluster_id
+    LEFT JOIN depots d ON d.id = COALESCE(cl.depot_id, (SELECT id FROM depots LIMIT 1))
+    LEFT JOIN locations l ON l.appt_id = i.appt_id
+    LEFT JOIN appointments a ON a.id = i.appt_id
+    LEFT JOIN clients c ON c.id = a.client_id
+    {where}
+    ORDER BY i.cluster_id, i.sequence
+"""
+
+
+def iter_cluster_stops(conn, cluster_ids=None):
+    """
+    (cluster_id, [étapes]) pour chaque cluster ayant un itinéraire (ou ceux de `cluster_ids`),
+    étapes triées par séquence (dicts : colonnes de STOPS_SQL). Les lignes sont lues en flux.
+    """
+    where, params = "", ()
+    if cluster_ids is not None:
+        cluster_ids = list(cluster_ids)
+        if not cluster_ids:
+            return
+        where = f"WHERE i.cluster_id IN ({', '.join('?' for _ in cluster_ids)})"
+        params = cluster_ids
+
+    c = conn.cursor()
+    c.row_factory = None
+    c.execute(STOPS_SQL.format(where=where), params)
+    keys = [d[0] for d in c.description]
+    stops = (dict(zip(keys, row)) for row in c)
+    for cluster_id, group in groupby(stops, key=itemgetter("cluster_id")):
+        yield cluster_id, list(group)
+
+
+def load_cluster_stops(conn, cluster_id):
+    """Étapes d'un cluster (liste vide s'il n'a pas d'itinéraire)."""
+    return next((stops for _, stops in iter_cluster_stops(conn, [cluster_id])), [])
+
+
+def build_travels(cluster_id, stops):
+    """Trajets (Travel) d'un itinéraire, avec RDV (Appointment) et client (Client) liés."""
+    travels: list[Travel] = []
+    prev_appt: Appointment | None = None
+
+    for stop in stops:
+        appt = None
+        if stop["appt_id"]:
+            client = Client(id=stop["client_id"], nom=stop["client_nom"], address=stop["client_address"])
+            appt = Appointment(
+                id=stop["appt_id"],
+                client_id=client.id,
+                num=stop["num"], rue=stop["rue"], ville=stop["ville"], zip=stop["zip"],
+                type=stop["type"], duration=stop["duration"]
+            )
+            appt.client = client  # lien objet, non DB
+
+        travel = Travel(
+            origin_appt_id=prev_appt.id if prev_appt else None,
+            dest_appt_id=appt.id if appt else None,
+            cluster_id=cluster_id,
+            depart_time=stop["depart_time"],
+            arrive_time=stop["arrive_time"],
+            travel_time=stop["travel_time_prev"],
+            distance=stop["distance_prev"]
+        )
+        # enrichissement pour l'affichage
+        travel.seq = stop["sequence"]
+        travel.duration_visit = stop["duration_visit"]
+        travel.origin = prev_appt
+        travel.destination = appt
+
+        travels.append(travel)
+        prev_appt = appt
+    return travels
@@ -0,0 +1,172 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from mods.db import get_connection
+from mods.profiling import profile, timer, save_run
+
+# ============================================================
+# Traitements de fond (pipeline d'optimisation)
+# Un job = une suite d'étapes exécutées dans un thread du processus
+# Streamlit ; son état (étape courante, durées, erreur) est persisté
+# dans la table jobs et lu par l'interface par interrogation régulière.
+# Les mesures de chaque exécution (mods.profiling) vont dans pipeline_runs.
+# ============================================================
+
+JOBS_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,   -- running | done | failed
+        stage TEXT,
+        stages TEXT NOT NULL,   -- JSON [{name, label, status, started_at, duration_s}, ...]
+        error TEXT,
+        pid INTEGER,
+        created_at TEXT NOT NULL,
+        finished_at TEXT
+    )
+    """,
+    # Au plus un job en cours par type, garanti par la base (plusieurs sessions, plusieurs processus)
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_one_running ON jobs (kind) WHERE status = 'running'",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_kind ON jobs (kind, id)",
+]
+
+_THREADS = {}  # job_id -> thread d'exécution (processus courant)
+_LOCK = threading.Lock()
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def reap_stale_jobs(conn):
+    """Passe en échec les jobs "running" dont le thread ou le processus a disparu (redémarrage)."""
+    stale = []
+    for job_id, pid in conn.execute("SELECT id, pid FROM jobs WHERE status = 'running'").fetchall():
+        if pid == os.getpid():
+            thread = _THREADS.get(job_id)
+            alive = thread is not None and thread.is_alive()
+        else:
+            alive = pid is not None and _pid_alive(pid)
+        if not alive:
+            stale.append(job_id)
+    if stale:
+        conn.executemany(
+            "UPDATE jobs SET status = 'failed', error = 'Interrompu (processus arrêté)', finished_at = ? WHERE id = ?",
+            [(_now(), job_id) for job_id in stale],
+        )
+        conn.commit()
+
+
+def submit_job(db_path, kind, stages):
+    """
+    Lance stages [(nom, libellé, fonction sans argument), ...] dans un thread de fond.
+    Retourne (job_id, True), ou (id du job déjà en cours, False) si un job `kind` tourne.
+    """
+    state = [
+        {"name": name, "label": label, "status": "pending", "started_at": None, "duration_s": None}
+        for name, label, _ in stages
+    ]
+    with _LOCK:
+        conn = get_connection(db_path)
+        try:
+            reap_stale_jobs(conn)
+            try:
+                cur = conn.execute(
+                    "INSERT INTO jobs (kind, status, stages, pid, created_at) VALUES (?, 'running', ?, ?, ?)",
+                    (kind, json.dumps(state), os.getpid(), _now()),
+                )
+                conn.commit()
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                row = conn.execute("SELECT id FROM jobs WHERE kind = ? AND status = 'running'", (kind,)).fetchone()
+                return (row[0] if row else None), False
+            job_id = cur.lastrowid
+        finally:
+            conn.close()
+
+        thread = threading.Thread(
+            target=_run, args=(db_path, job_id, kind, stages, state), name=f"job-{kind}-{job_id}", daemon=True
+        )
+        _THREADS[job_id] = thread
+        thread.start()
+    return job_id, True
+
+
+def _save(conn, job_id, state, stage=None, status="running", error=None):
+    conn.execute(
+        "UPDATE jobs SET status = ?, stage = ?, stages = ?, error = ?, finished_at = ? WHERE id = ?",
+        (status, stage, json.dumps(state), error, None if status == "running" else _now(), job_id),
+    )
+    conn.commit()
+
+
+def _run(db_path, job_id, kind, stages, state):
+    conn = get_connection(db_path)
+    started_at, run_start = _now(), time.perf_counter()
+    status = "failed"
+    try:
+        with profile() as profiler:
+            for entry, (_, _, func) in zip(state, stages):
+                entry.update(status="running", started_at=_now())
+                _save(conn, job_id, state, stage=entry["name"])
+                start = time.perf_counter()
+                try:
+                    with timer(f"stage.{entry['name']}"):
+                        func()
+                except Exception as e:
+                    traceback.print_exc()
+                    entry.update(status="failed", duration_s=round(time.perf_counter() - start, 2))
+                    _save(conn, job_id, state, entry["name"], "failed", f"{entry['label']} : {e}")
+                    return
+                entry.update(status="done", duration_s=round(time.perf_counter() - start, 2))
+            _save(conn, job_id, state, status="done")
+            status = "done"
+    finally:
+        try:
+            save_run(conn, kind, profiler, status, started_at, time.perf_counter() - run_start, job_id)
+        except sqlite3.Error as e:
+            print(f"[!] Mesures du job {job_id} non enregistrées : {e}")
+        conn.close()
+        _THREADS.pop(job_id, None)
+
+
+def _job_from_row(row):
+    if row is None:
+        return None
+    keys = ("id", "kind", "status", "stage", "stages", "error", "created_at", "finished_at")
+    job = dict(zip(keys, row))
+    job["stages"] = json.loads(job["stages"])
+    return job
+
+
+def get_job(conn, job_id):
+    """Job (dict, étapes décodées) ou None."""
+    return _job_from_row(conn.execute(
+        "SELECT id, kind, status, stage, stages, error, created_at, finished_at FROM jobs WHERE id = ?",
+        (job_id,),
+    ).fetchone())
+
+
+def latest_job(conn, kind):
+    """Dernier job d'un type (en cours ou terminé), ou None."""
+    return _job_from_row(conn.execute(
+        "SELECT id, kind, status, stage, stages, error, created_at, finished_at FROM jobs "
+        "WHERE kind = ? ORDER BY id DESC LIMIT 1",
+        (kind,),
+    ).fetchone())
@@ -1,53 +1,121 @@
-import sqlite3, folium, requests, random
+import folium, requests, random, hashlib, json, os, tempfile
+import numpy as np
+from folium.plugins import FastMarkerCluster
+from datetime import datetime
+
+from mods.db import get_connection
+from mods.itineraries import iter_cluster_stops, load_cluster_stops
+from mods.migrations import migrate
+from mods.profiling import count
+from mods.routing import ORSProvider, ORS_DIRECTIONS_URL, ors_route_geometry  # noqa: F401 (ré-export)
+
+ROUTE_CACHE_SQL = """
+    CREATE TABLE IF NOT EXISTS route_geometry_cache (
+        cluster_id INTEGER NOT NULL,
+        itin_hash TEXT NOT NULL,
+        geometry TEXT NOT NULL,
+        updated_at TEXT,
+        PRIMARY KEY (cluster_id, itin_hash)
+    )
+"""
 
 def random_color():
     return "#{:06x}".format(random.randint(0, 0xFFFFFF))
 
-def plot_clusters_map_v2(db_path, API_key, output_html="clusters_map_routes.html"):
-    conn = sqlite3.connect(db_path)
+# Couleurs stables d'une génération de carte à l'autre (une par cluster)
+PALETTE = [
+    "#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4", "#46f0f0", "#f032e6", "#bcbd22",
+    "#008080", "#9a6324", "#800000", "#808000", "#000075", "#e377c2", "#17becf", "#ff7f0e",
+]
+
+def cluster_color(cluster_id):
+    """Couleur déterministe d'un cluster."""
+    return PALETTE[int(cluster_id) % len(PALETTE)]
+
+def route_coords(stops):
+    """
+    Points [lon, lat] du tracé d'un itinéraire (étapes de mods.itineraries) : départ du dépôt
+    puis chaque étape. Séquence commune à toutes les cartes (clé de route_geometry_cache).
+    """
+    depot = [[stops[0]["depot_lon"], stops[0]["depot_lat"]]] if stops[0]["depot_lat"] is not None else []
+    return depot + [[stop["lon"], stop["lat"]] for stop in stops if stop["lat"] is not None]
+
+def itinerary_hash(coords, profile=""):
+    """Empreinte d'une séquence ordonnée de points [lon, lat] pour un profil de routage."""
+    payload = profile + "|" + ";".join(f"{lon:.5f},{lat:.5f}" for lon, lat in coords)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def cached_route_geometry(conn, cluster_id, coords, provider):
+    """Géométrie du cluster depuis route_geometry_cache, calculée seulement si la séquence a changé."""
+    conn.execute(ROUTE_CACHE_SQL)
+    itin_hash = itinerary_hash(coords, provider.profile)
+    c = conn.cursor()
+    c.execute(
+        "SELECT geometry FROM route_geometry_cache WHERE cluster_id = ? AND itin_hash = ?",
+        (cluster_id, itin_hash),
+    )
+    row = c.fetchone()
+    if row:
+        count("cache.route.hits")
+        return json.loads(row[0])
+
+    count("cache.route.misses")
+    geometry = provider.directions(coords, label=f"cluster {cluster_id}")
+    if geometry is None:
+        return None
+
+    # Une seule géométrie par cluster : l'ancienne séquence est obsolète
+    c.execute("DELETE FROM route_geometry_cache WHERE cluster_id = ?", (cluster_id,))
+    c.execute(
+        "INSERT INTO route_geometry_cache (cluster_id, itin_hash, geometry, updated_at) VALUES (?, ?, ?, ?)",
+        (cluster_id, itin_hash, json.dumps(geometry), datetime.now().isoformat(timespec="seconds")),
+    )
+    conn.commit()
+    return geometry
+
+def plot_clusters_map_v2(db_path, API_key, output_html="clusters_map_routes.html", batched=True, provider=None):
+    """
+    Carte Folium des itinéraires.
+    batched=True : un appel Directions multi-points par cluster, mis en cache
+    par (cluster, empreinte de la séquence) ; batched=False : un appel ORS par segment.
+    provider : RoutingProvider pour le mode batched (ORS avec API_key par défaut).
+    """
+    provider = provider or ORSProvider(API_key)
+    conn = get_connection(db_path)
+    migrate(conn, verbose=False)  # clusters.depot_id, route_geometry_cache
     c = conn.cursor()
 
     # Récupérer le dépôt
     c.execute("SELECT lat, lon FROM depots LIMIT 1")
     depot_lat, depot_lon = c.fetchone()
 
-    # Récupérer les clusters
-    c.execute("SELECT DISTINCT cluster_id FROM itineraries")
-    cluster_ids = [row[0] for row in c.fetchall()]
-
     m = folium.Map(location=[depot_lat, depot_lon], zoom_start=12)
 
-    for cluster_id in cluster_ids:
-        # Itinéraire trié
-        c.execute("""
-            SELECT appt_id, sequence
-            FROM itineraries
-            WHERE cluster_id = ?
-            ORDER BY sequence
-        """, (cluster_id,))
-        itin = c.fetchall()
-
-        coords = []
-        for appt_id, seq in itin:
-            if appt_id is None:  # Dépôt
-                lat, lon = depot_lat, depot_lon
-            else:
-                c.execute("SELECT lat, lon FROM locations WHERE appt_id = ?", (appt_id,))
-                lat, lon = c.fetchone()
-            coords.append([lon, lat])  # ORS attend [lon, lat]
+    # Toutes les étapes en une requête jointe, regroupées par cluster
+    for cluster_id, stops in iter_cluster_stops(conn):
+        coords = route_coords(stops)  # départ du dépôt, ORS attend [lon, lat]
+        for stop in stops:
+            if stop["lat"] is None:
+                continue
 
             # Ajouter un marker
             folium.Marker(
-                [lat, lon],
-                popup=f"Cluster {cluster_id}, seq {seq}, appt {appt_id if appt_id else 'DEPOT'}"
+                [stop["lat"], stop["lon"]],
+                popup=f"Cluster {cluster_id}, seq {stop['sequence']}, appt {stop['appt_id'] or 'DEPOT'}"
             ).add_to(m)
 
+        if batched:
+            geometry = cached_route_geometry(conn, cluster_id, coords, provider)
+            if geometry:
+                route = [(lat, lon) for lon, lat in geometry]  # inversion lon/lat
+                folium.PolyLine(route, color=random_color(), weight=3, opacity=0.7).add_to(m)
+            continue
+
         # Requête ORS directions
-        ors_url = "https://api.openrouteservice.org/v2/directions/driving-car/geojson"
         headers = {"Authorization": API_key, "Content-Type": "application/json"}
         for i in range(len(coords) - 1):
             body = {"coordinates": [coords[i], coords[i+1]]}
-            resp = requests.post(ors_url, json=body, headers=headers)
+            resp = requests.post(ORS_DIRECTIONS_URL, json=body, headers=headers)
 
             if resp.status_code == 200:
                 data = resp.json()
@@ -62,4 +130,283 @@ def plot_clusters_map_v2(db_path, API_key, output_html="clusters_map_routes.html
 
     conn.close()
     m.save(output_html)
-    print(f"Carte générée avec trajets routiers : {output_html}")
\ No newline at end of file
+    print(f"Carte générée avec trajets routiers : {output_html}")
+
+
+# ============================================================
+# Carte allégée (grands volumes d'itinéraires)
+# Une couche GeoJSON simplifiée par cluster (affichable/masquable),
+# arrêts regroupés côté navigateur (FastMarkerCluster) : le HTML ne
+# contient que des coordonnées, pas un objet Leaflet par arrêt ou segment.
+# ============================================================
+
+SIMPLIFY_TOLERANCE_M = 15  # écart maximal toléré entre le tracé simplifié et l'original
+COORD_DECIMALS = 5         # ~1 m
+
+# Arrêt dessiné par le navigateur à partir de [lat, lon, popup, couleur]
+STOP_MARKER_JS = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: 6, color: row[3], fillColor: row[3], fillOpacity: 0.8, weight: 1});
+    marker.bindPopup(row[2]);
+    return marker;
+}
+"""
+
+def simplify_line(coords, tolerance_m=SIMPLIFY_TOLERANCE_M):
+    """
+    Douglas–Peucker (itératif) sur une ligne [[lon, lat], ...] ; distances en mètres
+    (projection équirectangulaire locale). Les extrémités sont conservées.
+    """
+    pts = np.asarray(coords, dtype=float)
+    n = len(pts)
+    if n < 3 or tolerance_m <= 0:
+        return pts.tolist()
+
+    xy = pts * 111_320.0
+    xy[:, 0] *= np.cos(np.radians(pts[:, 1].mean()))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = xy[first], xy[last]
+        inner = xy[first + 1:last]
+        dx, dy = b - a
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            dist = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            dist = np.abs(dx * (inner[:, 1] - a[1]) - dy * (inner[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance_m:
+            split = first + 1 + i
+            keep[split] = True
+            stack += [(first, split), (split, last)]
+    return pts[keep].tolist()
+
+def cluster_feature(cluster_id, cluster_name, line):
+    """Feature GeoJSON (LineString) du tracé d'un cluster."""
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [[round(lon, COORD_DECIMALS), round(lat, COORD_DECIMALS)] for lon, lat in line],
+        },
+        "properties": {"cluster_id": cluster_id, "name": cluster_name, "color": cluster_color(cluster_id)},
+    }
+
+def plot_clusters_map_light(db_path, API_key=None, output_html="clusters_map_light.html", provider=None,
+                            tolerance_m=SIMPLIFY_TOLERANCE_M):
+    """
+    Carte Folium allégée des itinéraires : une couche par cluster (LayerControl),
+    tracé simplifié (Douglas–Peucker), couleurs déterministes, arrêts en FastMarkerCluster.
+    Tracés routiers via route_geometry_cache / provider (ORS si API_key) ;
+    sans provider ni clé, lignes droites entre arrêts.
+    """
+    if provider is None and API_key:
+        provider = ORSProvider(API_key)
+    conn = get_connection(db_path)
+    migrate(conn, verbose=False)  # clusters.depot_id, route_geometry_cache
+
+    m = folium.Map(zoom_start=12, prefer_canvas=True)
+    stops_data = []   # [lat, lon, popup, couleur]
+    depots = {}       # depot_id -> (lat, lon)
+    n_points = n_kept = 0
+
+    for cluster_id, stops in iter_cluster_stops(conn):
+        cluster_name = stops[0]["cluster_name"]
+        color = cluster_color(cluster_id)
+        coords = route_coords(stops)
+        if len(coords) < 2:
+            continue
+        if stops[0]["depot_id"] is not None:
+            depots[stops[0]["depot_id"]] = (stops[0]["depot_lat"], stops[0]["depot_lon"])
+
+        for stop in stops:
+            if stop["appt_id"] and stop["lat"] is not None:
+                stops_data.append([
+                    round(stop["lat"], COORD_DECIMALS), round(stop["lon"], COORD_DECIMALS),
+                    f"{cluster_name} — étape {stop['sequence']}, RDV {stop['appt_id']}", color,
+                ])
+
+        geometry = cached_route_geometry(conn, cluster_id, coords, provider) if provider else None
+        line = simplify_line(geometry or coords, tolerance_m)
+        n_points += len(geometry or coords)
+        n_kept += len(line)
+
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": [cluster_feature(cluster_id, cluster_name, line)]},
+            name=f'<span style="color:{color}">●</span> {cluster_name}',
+            style_function=lambda feature: {"color": feature["properties"]["color"], "weight": 3, "opacity": 0.8},
+            tooltip=cluster_name,
+        ).add_to(m)
+
+    conn.close()
+
+    for depot_lat, depot_lon in depots.values():
+        folium.Marker([depot_lat, depot_lon], popup="Dépôt", icon=folium.Icon(color="black", icon="home")).add_to(m)
+    if stops_data:
+        FastMarkerCluster(stops_data, callback=STOP_MARKER_JS, name="Arrêts").add_to(m)
+        lats = [row[0] for row in stops_data]
+        lons = [row[1] for row in stops_data]
+        m.fit_bounds([[min(lats), min(lons)], [max(lats), max(lons)]])
+    folium.LayerControl(collapsed=True).add_to(m)
+
+    m.save(output_html)
+    print(f"Carte allégée générée : {output_html} ({len(stops_data)} arrêts, "
+          f"tracés simplifiés {n_points} -> {n_kept} points)")
+
+
+# ============================================================
+# Artefacts GeoJSON par cluster (chargement à la demande)
+# Un fichier par cluster dans un répertoire de cache adressé par contenu :
+# son nom est l'empreinte des données qui le composent (étapes, profil de
+# routage, tolérance). Un itinéraire inchangé n'est jamais recalculé ;
+# un itinéraire modifié produit un nouveau fichier. Un tracé de repli
+# (lignes droites après échec du routage) n'est jamais mis en cache.
+# ============================================================
+
+GEOJSON_CACHE_DIR = "map_cache"
+GEOJSON_FORMAT = 2  # à incrémenter si le contenu des artefacts change
+
+def cluster_geojson_key(stops, profile="", tolerance_m=SIMPLIFY_TOLERANCE_M):
+    """Empreinte (sha1) des données d'un artefact GeoJSON de cluster."""
+    payload = [GEOJSON_FORMAT, profile, tolerance_m] + [
+        [stop[k] for k in ("cluster_id", "cluster_name", "sequence", "appt_id", "lat", "lon",
+                           "arrive_time", "depart_time", "client_nom")]
+        for stop in stops
+    ]
+    return hashlib.sha1(json.dumps(payload, default=str).encode("utf-8")).hexdigest()
+
+def build_cluster_geojson(conn, cluster_id, stops, provider=None, tolerance_m=SIMPLIFY_TOLERANCE_M):
+    """
+    FeatureCollection d'un cluster : tracé (LineString simplifié, départ du dépôt) puis une Point
+    par étape, avec bbox [min_lon, min_lat, max_lon, max_lat] ; properties.routed indique si le
+    tracé vient du provider (False : lignes droites).
+    """
+    cluster_name = stops[0]["cluster_name"]
+    color = cluster_color(cluster_id)
+    located = [stop for stop in stops if stop["lat"] is not None]
+    coords = route_coords(stops)
+
+    geometry = cached_route_geometry(conn, cluster_id, coords, provider) if provider and len(coords) > 1 else None
+    features = [cluster_feature(cluster_id, cluster_name, simplify_line(geometry or coords, tolerance_m))]
+    for stop in located:
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(stop["lon"], COORD_DECIMALS), round(stop["lat"], COORD_DECIMALS)]},
+            "properties": {
+                "sequence": stop["sequence"],
+                "appt_id": stop["appt_id"],
+                "label": f"{stop['sequence']}. {stop['client_nom'] or 'Dépôt'}",
+                "arrive_time": stop["arrive_time"],
+                "depart_time": stop["depart_time"],
+                "color": "#000000" if stop["appt_id"] is None else color,
+            },
+        })
+
+    lons = [lon for lon, _ in coords] or [0.0]
+    lats = [lat for _, lat in coords] or [0.0]
+    return {
+        "type": "FeatureCollection",
+        "bbox": [min(lons), min(lats), max(lons), max(lats)],
+        "properties": {"cluster_id": cluster_id, "name": cluster_name, "color": color, "routed": geometry is not None},
+        "features": features,
+    }
+
+def cluster_geojson(conn, cluster_id, stops, provider=None, cache_dir=GEOJSON_CACHE_DIR,
+                    tolerance_m=SIMPLIFY_TOLERANCE_M):
+    """
+    (FeatureCollection, chemin de l'artefact) d'un cluster : lue depuis le cache, sinon construite
+    et écrite de façon atomique. Chemin None si le routage a échoué (tracé de repli non mis en cache).
+    """
+    key = cluster_geojson_key(stops, provider.profile if provider else "", tolerance_m)
+    path = os.path.join(cache_dir, f"{key}.geojson")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f), path
+
+    data = build_cluster_geojson(conn, cluster_id, stops, provider, tolerance_m)
+    if provider and not data["properties"]["routed"]:
+        print(f"[!] Tracé du cluster {cluster_id} indisponible, lignes droites non mises en cache")
+        return data, None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return data, path
+
+def export_clusters_geojson(db_path, API_key=None, provider=None, cache_dir=GEOJSON_CACHE_DIR,
+                            tolerance_m=SIMPLIFY_TOLERANCE_M, prune=True):
+    """
+    Écrit les artefacts de tous les clusters et l'index {cluster_id: {name, file}} (index.json) ;
+    les clusters dont le routage a échoué n'y figurent pas. prune=True : supprime les artefacts qui ne correspondent plus à aucun itinéraire.
+    """
+    if provider is None and API_key:
+        provider = ORSProvider(API_key)
+    conn = get_connection(db_path)
+    migrate(conn, verbose=False)  # clusters.depot_id, route_geometry_cache
+    index = {}
+    try:
+        for cluster_id, stops in iter_cluster_stops(conn):
+            _, path = cluster_geojson(conn, cluster_id, stops, provider, cache_dir, tolerance_m)
+            if path is None:
+                continue
+            index[str(cluster_id)] = {"name": stops[0]["cluster_name"], "file": os.path.basename(path)}
+    finally:
+        conn.close()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+
+    if prune:
+        used = {entry["file"] for entry in index.values()}
+        for name in os.listdir(cache_dir):
+            if name.endswith(".geojson") and name not in used:
+                os.remove(os.path.join(cache_dir, name))
+    print(f"✅ {len(index)} artefacts GeoJSON dans {cache_dir}")
+    return index
+
+def load_cluster_geojson(db_path, cluster_id, provider=None, cache_dir=GEOJSON_CACHE_DIR,
+                         tolerance_m=SIMPLIFY_TOLERANCE_M):
+    """FeatureCollection d'un seul cluster (lue depuis le cache ou générée), ou None sans itinéraire."""
+    conn = get_connection(db_path)
+    try:
+        migrate(conn, verbose=False)
+        stops = load_cluster_stops(conn, cluster_id)
+        if not stops:
+            return None
+        return cluster_geojson(conn, cluster_id, stops, provider, cache_dir, tolerance_m)[0]
+    finally:
+        conn.close()
+
+def cluster_map(geojson, zoom_start=13):
+    """Carte Folium d'un artefact de cluster (tracé + étapes), cadrée sur sa bbox."""
+    min_lon, min_lat, max_lon, max_lat = geojson["bbox"]
+    m = folium.Map(location=[(min_lat + max_lat) / 2, (min_lon + max_lon) / 2], zoom_start=zoom_start)
+    route = {"type": "FeatureCollection", "features": geojson["features"][:1]}
+    points = {"type": "FeatureCollection", "features": geojson["features"][1:]}
+    folium.GeoJson(
+        route,
+        style_function=lambda feature: {"color": feature["properties"]["color"], "weight": 4, "opacity": 0.8},
+    ).add_to(m)
+    folium.GeoJson(
+        points,
+        marker=folium.CircleMarker(radius=7, fill=True, fill_opacity=0.9, weight=1),
+        style_function=lambda feature: {"color": feature["properties"]["color"], "fillColor": feature["properties"]["color"]},
+        tooltip=folium.GeoJsonTooltip(fields=["label"], labels=False),
+    ).add_to(m)
+    if (min_lat, min_lon) != (max_lat, max_lon):
+        m.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
+    return m
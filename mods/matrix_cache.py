@@ -0,0 +1,159 @@
+import sqlite3
+from datetime import datetime
+
+from mods.profiling import count, timed
+
+# Précision des clés : 5 décimales ≈ 1 m, suffisant pour des adresses géocodées
+COORD_PRECISION = 5
+_SCALE = 10 ** COORD_PRECISION
+
+MATRIX_CACHE_SQL = """
+    CREATE TABLE IF NOT EXISTS matrix_cache (
+        profile TEXT NOT NULL,
+        src_lat INTEGER NOT NULL,
+        src_lon INTEGER NOT NULL,
+        dst_lat INTEGER NOT NULL,
+        dst_lon INTEGER NOT NULL,
+        duration REAL NOT NULL,
+        distance REAL NOT NULL,
+        updated_at TEXT,
+        PRIMARY KEY (profile, src_lat, src_lon, dst_lat, dst_lon)
+    ) WITHOUT ROWID
+"""
+
+
+def ensure_matrix_cache(conn: sqlite3.Connection) -> None:
+    """Crée la table matrix_cache si elle n'existe pas."""
+    conn.execute(MATRIX_CACHE_SQL)
+
+
+def coord_key(lat, lon):
+    """Clé entière (lat, lon) arrondie à COORD_PRECISION décimales."""
+    return int(round(lat * _SCALE)), int(round(lon * _SCALE))
+
+
+@timed("db.matrix_cache")
+def load_cached_pairs(conn, points, profile="driving-car"):
+    """
+    Charge depuis le cache les paires (origine, destination) connues entre `points`.
+    points : [(lat, lon), ...]
+    Retourne {(i, j): (duration_s, distance_m)}.
+    """
+    keys = [coord_key(lat, lon) for lat, lon in points]
+    positions = {}
+    for idx, key in enumerate(keys):
+        positions.setdefault(key, []).append(idx)
+
+    c = conn.cursor()
+    found = {}
+    for src_key in positions:
+        c.execute("""
+            SELECT dst_lat, dst_lon, duration, distance
+            FROM matrix_cache
+            WHERE profile = ? AND src_lat = ? AND src_lon = ?
+        """, (profile, src_key[0], src_key[1]))
+        for dst_lat, dst_lon, duration, distance in c.fetchall():
+            dst_idx = positions.get((dst_lat, dst_lon))
+            if not dst_idx:
+                continue
+            for i in positions[src_key]:
+                for j in dst_idx:
+                    found[(i, j)] = (duration, distance)
+    return found
+
+
+@timed("db.matrix_cache")
+def store_pairs(conn, points, pairs, profile="driving-car"):
+    """
+    Enregistre des paires calculées.
+    pairs : {(i, j): (duration_s, distance_m)} indexées sur `points`.
+    """
+    now = datetime.now().isoformat(timespec="seconds")
+    keys = [coord_key(lat, lon) for lat, lon in points]
+    rows = [
+        (profile, *keys[i], *keys[j], duration, distance, now)
+        for (i, j), (duration, distance) in pairs.items()
+        if duration is not None and distance is not None
+    ]
+    conn.executemany("""
+        INSERT OR REPLACE INTO matrix_cache
+        (profile, src_lat, src_lon, dst_lat, dst_lon, duration, distance, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+    return len(rows)
+
+
+def _missing_blocks(n, missing):
+    """
+    Découpe les paires manquantes en rectangles (sources, destinations) à demander.
+    Cas courant : quelques nouveaux points → une ligne et une colonne par point,
+    plutôt que toute la matrice.
+    """
+    missing = set(missing)
+    missing_count = {}
+    for i, j in missing:
+        missing_count[i] = missing_count.get(i, 0) + 1
+    # Points jamais vus : toute leur ligne manque (hors diagonale)
+    new_points = sorted(i for i, count in missing_count.items() if count >= n - 1)
+
+    blocks = []
+    if new_points and len(new_points) < n:
+        old_points = [i for i in range(n) if i not in set(new_points)]
+        blocks.append((new_points, list(range(n))))
+        blocks.append((old_points, new_points))
+        missing -= {(i, j) for i in new_points for j in range(n)}
+        missing -= {(i, j) for i in old_points for j in new_points}
+
+    if missing:
+        blocks.append((sorted({i for i, _ in missing}), sorted({j for _, j in missing})))
+    return blocks
+
+
+def cached_matrix(conn, points, fetch, profile="driving-car", verbose=True):
+    """
+    Assemble les matrices durée/distance pour `points` en ne demandant que les paires manquantes.
+
+    fetch(sources, destinations) doit renvoyer {"durations": [...], "distances": [...]}
+    pour les sous-ensembles d'indices demandés (format ORS), ou None en cas d'échec.
+    Retourne {"durations": [[...]], "distances": [[...]]} ou None.
+    """
+    ensure_matrix_cache(conn)
+    n = len(points)
+    pairs = load_cached_pairs(conn, points, profile)
+
+    # La diagonale est triviale, inutile de la demander
+    for i in range(n):
+        pairs.setdefault((i, i), (0.0, 0.0))
+
+    missing = [(i, j) for i in range(n) for j in range(n) if (i, j) not in pairs]
+    count("cache.matrix.hits", n * n - len(missing))
+    count("cache.matrix.misses", len(missing))
+    if verbose:
+        print(f"  Cache matrice : {n * n - len(missing)}/{n * n} paires connues")
+
+    if missing:
+        fetched = {}
+        for sources, destinations in _missing_blocks(n, missing):
+            data = fetch(sources, destinations)
+            if not data:
+                return None
+            for si, i in enumerate(sources):
+                for di, j in enumerate(destinations):
+                    duration = data["durations"][si][di]
+                    distance = data["distances"][si][di]
+                    if duration is None or distance is None:
+                        continue
+                    fetched[(i, j)] = (duration, distance)
+
+        store_pairs(conn, points, fetched, profile)
+        pairs.update(fetched)
+
+        if any((i, j) not in pairs for i, j in missing):
+            print("[X] Paires manquantes après l'appel ORS (point non routable ?)")
+            return None
+
+    return {
+        "durations": [[pairs[(i, j)][0] for j in range(n)] for i in range(n)],
+        "distances": [[pairs[(i, j)][1] for j in range(n)] for i in range(n)],
+    }
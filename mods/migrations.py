@@ -0,0 +1,172 @@
+import sqlite3
+
+# ============================================================
+# Migrations de schéma versionnées (PRAGMA user_version)
+# Chaque migration est appliquée une seule fois, dans une transaction,
+# puis user_version passe à son numéro. Ne jamais modifier une migration
+# publiée : en ajouter une nouvelle à la fin de MIGRATIONS.
+# ============================================================
+
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def add_column(conn, table, column, decl):
+    """ALTER TABLE ... ADD COLUMN si la colonne n'existe pas encore."""
+    if column not in table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _v1_columns(conn):
+    """Colonnes autrefois ajoutées à l'exécution (géocodage, VRP)."""
+    add_column(conn, "locations", "address", "TEXT")
+    add_column(conn, "clusters", "depot_id", "INTEGER")
+
+
+def _v2_indexes(conn):
+    """Index des colonnes de recherche."""
+    for sql in (
+        "CREATE INDEX IF NOT EXISTS idx_locations_appt_id ON locations (appt_id)",
+        "CREATE INDEX IF NOT EXISTS idx_locations_address ON locations (address)",
+        # cluster_name seul est couvert par le préfixe de l'index composite
+        "CREATE INDEX IF NOT EXISTS idx_clusters_name_appt ON clusters (cluster_name, appt_id)",
+        "CREATE INDEX IF NOT EXISTS idx_clusters_appt_id ON clusters (appt_id)",
+        # WHERE cluster_id = ? ORDER BY sequence sans tri
+        "CREATE INDEX IF NOT EXISTS idx_itineraries_cluster_seq ON itineraries (cluster_id, sequence)",
+        "CREATE INDEX IF NOT EXISTS idx_clients_nom_address ON clients (nom, address)",
+    ):
+        conn.execute(sql)
+
+
+def _v3_cache_tables(conn):
+    """Tables de cache et d'état créées jusqu'ici à la demande."""
+    from mods.matrix_cache import MATRIX_CACHE_SQL
+    from mods.geocode import GEOCODE_CACHE_SQL
+    from mods.map_gen import ROUTE_CACHE_SQL
+    from mods.tsr_plan import ITINERARY_STATE_SQL
+
+    for sql in [MATRIX_CACHE_SQL, *GEOCODE_CACHE_SQL, ROUTE_CACHE_SQL, ITINERARY_STATE_SQL]:
+        conn.execute(sql)
+
+
+def _v4_jobs(conn):
+    """Table des traitements de fond."""
+    from mods.jobs import JOBS_SQL
+
+    for sql in JOBS_SQL:
+        conn.execute(sql)
+
+
+# Tables dont les modifications invalident les caches de l'interface (mods.ui_data)
+TRACKED_TABLES = ("clients", "depots", "appointments", "locations", "clusters", "itineraries")
+
+
+def _v5_revisions(conn):
+    """
+    Compteur de modifications par table, incrémenté par triggers quel que soit
+    l'écrivain (pages, job de fond, import) ; sert de clé aux caches st.cache_data.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS table_revisions (
+            name TEXT PRIMARY KEY,
+            rev INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for table in TRACKED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO table_revisions (name) VALUES (?)", (table,))
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_rev AFTER {op} ON {table}
+                BEGIN
+                    UPDATE table_revisions SET rev = rev + 1 WHERE name = '{table}';
+                END
+            """)
+    # Requêtes du calendrier bornées par dates
+    if "start_time" in table_columns(conn, "appointments"):
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_start ON appointments (start_time)")
+
+
+def _v6_pipeline_runs(conn):
+    """Historique des mesures du pipeline (mods.profiling)."""
+    from mods.profiling import PIPELINE_RUNS_SQL
+
+    for sql in PIPELINE_RUNS_SQL:
+        conn.execute(sql)
+
+
+# Ligne de table_revisions propre à chaque fichier de base (jeton aléatoire)
+EPOCH_REVISION = "_epoch"
+
+
+def _v7_epoch(conn):
+    """
+    Jeton aléatoire de la base, ajouté aux clés des caches de l'interface : une base recréée
+    (rebuild_database) repart à rev = 0 mais avec un autre jeton, ses caches ne sont pas réutilisés.
+    """
+    conn.execute(
+        "INSERT OR IGNORE INTO table_revisions (name, rev) VALUES (?, abs(random()))",
+        (EPOCH_REVISION,),
+    )
+
+
+MIGRATIONS = [
+    (1, "colonnes locations.address, clusters.depot_id", _v1_columns),
+    (2, "index de recherche", _v2_indexes),
+    (3, "tables de cache", _v3_cache_tables),
+    (4, "table jobs", _v4_jobs),
+    (5, "compteurs de modifications", _v5_revisions),
+    (6, "table pipeline_runs", _v6_pipeline_runs),
+    (7, "jeton de base", _v7_epoch),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, verbose=True):
+    """
+    Applique les migrations manquantes sur une connexion ouverte.
+    S'arrête à la première migration en échec (annulée) ; retourne la version atteinte.
+    Si l'appelant a une transaction en cours, chaque migration est un SAVEPOINT de
+    celle-ci (validée avec elle) : seule la migration en échec est annulée.
+    """
+    version = schema_version(conn)
+    nested = conn.in_transaction
+    for number, label, step in MIGRATIONS:
+        if number <= version:
+            continue
+        savepoint = f"migration_{number}"
+        try:
+            conn.execute(f"SAVEPOINT {savepoint}" if nested else "BEGIN")
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            if nested:
+                conn.execute(f"RELEASE {savepoint}")
+            else:
+                conn.commit()
+        except sqlite3.Error as e:
+            if nested:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+            else:
+                conn.rollback()
+            print(f"[X] Migration {number} ({label}) échouée : {e}")
+            break
+        version = number
+        if verbose:
+            print(f"✅ Migration {number} appliquée : {label}")
+    return version
+
+
+def migrate_db(db_path, verbose=True):
+    """Ouvre la base, applique les migrations manquantes et retourne la version atteinte."""
+    from mods.db import get_connection
+    conn = get_connection(db_path)
+    try:
+        return migrate(conn, verbose)
+    finally:
+        conn.close()
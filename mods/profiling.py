@@ -0,0 +1,214 @@
+import contextvars
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# ============================================================
+# Profilage du pipeline d'optimisation
+# Chronomètres (timer / timed), compteurs (count) et valeurs (record)
+# alimentent le Profiler actif (profile()) ; sans profil actif, ce sont
+# des no-op. Le résultat d'une exécution est enregistré dans pipeline_runs
+# et affiché sur la page Tech.
+# ============================================================
+
+PIPELINE_RUNS_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS pipeline_runs (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        job_id INTEGER,
+        status TEXT NOT NULL,
+        started_at TEXT NOT NULL,
+        duration_s REAL,
+        timers TEXT NOT NULL,    -- JSON {nom: {count, total_s}}
+        counters TEXT NOT NULL,  -- JSON {nom: valeur cumulée}
+        metrics TEXT NOT NULL    -- JSON {nom: dernière valeur}
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pipeline_runs_kind ON pipeline_runs (kind, id)",
+]
+
+_current = contextvars.ContextVar("profiler", default=None)
+
+
+class Profiler:
+    """Mesures d'une exécution ; alimentable depuis plusieurs threads."""
+
+    def __init__(self):
+        self.timers = {}    # nom -> [nb d'appels, durée totale (s)]
+        self.counters = {}
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            entry = self.timers.setdefault(name, [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, value):
+        with self._lock:
+            self.metrics[name] = value
+
+    def snapshot(self):
+        """Mesures sérialisables (JSON, pickle)."""
+        with self._lock:
+            return {
+                "timers": {name: {"count": n, "total_s": round(total, 4)} for name, (n, total) in self.timers.items()},
+                "counters": dict(self.counters),
+                "metrics": dict(self.metrics),
+            }
+
+    def merge(self, snapshot):
+        """Ajoute les mesures d'un autre profil (processus de calcul, par exemple)."""
+        for name, timer_ in snapshot["timers"].items():
+            self.add_time(name, timer_["total_s"], timer_["count"])
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+        for name, value in snapshot["metrics"].items():
+            self.record(name, value)
+
+
+@contextmanager
+def profile():
+    """Active un nouveau Profiler pour le bloc (et les fonctions qu'il appelle)."""
+    profiler = Profiler()
+    token = _current.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """Profiler actif, ou None."""
+    return _current.get()
+
+
+@contextmanager
+def timer(name):
+    """Chronomètre le bloc sous `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler = _current.get()
+        if profiler is not None:
+            profiler.add_time(name, time.perf_counter() - start)
+
+
+def timed(name=None):
+    """Décorateur : chronomètre chaque appel sous `name` (par défaut module.fonction)."""
+    def decorator(func):
+        label = name or f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    profiler = _current.get()
+    if profiler is not None:
+        profiler.count(name, n)
+
+
+def record(name, value):
+    profiler = _current.get()
+    if profiler is not None:
+        profiler.record(name, value)
+
+
+def merge(snapshot):
+    profiler = _current.get()
+    if profiler is not None and snapshot:
+        profiler.merge(snapshot)
+
+
+def call_profiled(func, *args, **kwargs):
+    """
+    Appelle func sous un profil neuf et retourne (résultat, mesures).
+    Pour les processus de calcul (ProcessPoolExecutor) : l'appelant fusionne avec merge().
+    """
+    with profile() as profiler:
+        result = func(*args, **kwargs)
+    return result, profiler.snapshot()
+
+
+def bind(func):
+    """func liée au profil courant, pour l'exécuter dans d'autres threads (ThreadPoolExecutor)."""
+    profiler = _current.get()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current.set(profiler)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return wrapper
+
+
+# ============================================================
+# Historique des exécutions (pipeline_runs)
+# ============================================================
+
+# Familles de chronomètres pour la répartition du temps d'une exécution
+# (durées cumulées : les appels parallèles peuvent dépasser la durée réelle)
+TIME_CATEGORIES = (
+    ("ors.", "Réseau (ORS)"),
+    ("db.", "SQLite"),
+    ("tsp.solve", "Solveur"),
+    ("tsp.exact", "Solveur"),
+    ("vrp.solve", "Solveur"),
+)
+
+
+def time_breakdown(timers):
+    """{famille: secondes} à partir des chronomètres d'une exécution."""
+    totals = {}
+    for name, timer_ in timers.items():
+        for prefix, label in TIME_CATEGORIES:
+            if name.startswith(prefix):
+                totals[label] = totals.get(label, 0.0) + timer_["total_s"]
+                break
+    return totals
+
+
+def save_run(conn, kind, profiler, status, started_at, duration_s, job_id=None):
+    """Enregistre les mesures d'une exécution ; retourne son id."""
+    snapshot = profiler.snapshot()
+    cur = conn.execute(
+        "INSERT INTO pipeline_runs (kind, job_id, status, started_at, duration_s, timers, counters, metrics) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (kind, job_id, status, started_at, round(duration_s, 3),
+         json.dumps(snapshot["timers"]), json.dumps(snapshot["counters"]), json.dumps(snapshot["metrics"], default=str)),
+    )
+    conn.commit()
+    return cur.lastrowid
+
+
+def recent_runs(conn, kind, limit=20):
+    """Dernières exécutions d'un type (plus récente en premier), mesures décodées."""
+    rows = conn.execute(
+        "SELECT id, kind, job_id, status, started_at, duration_s, timers, counters, metrics "
+        "FROM pipeline_runs WHERE kind = ? ORDER BY id DESC LIMIT ?",
+        (kind, limit),
+    ).fetchall()
+    keys = ("id", "kind", "job_id", "status", "started_at", "duration_s", "timers", "counters", "metrics")
+    runs = []
+    for row in rows:
+        run = dict(zip(keys, row))
+        for key in ("timers", "counters", "metrics"):
+            run[key] = json.loads(run[key])
+        runs.append(run)
+    return runs
@@ -1,20 +1,23 @@
-import sqlite3,os
+import os
 from config import SAMPLES,DEPOT1, TABLES_SQL
+from mods.migrations import migrate
+from mods.db import get_connection, remove_database
 
 # --- Fonctions ---
 def rebuild_database(db_path: str):
     """Supprime et recrée toutes les tables selon TABLES_SQL."""
     if os.path.exists(db_path):
-        os.remove(db_path)
+        remove_database(db_path)
         print(f"🧹 Ancienne base supprimée : {db_path}")
 
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path)
     c = conn.cursor()
 
     # Créer toutes les tables
     for name, sql in TABLES_SQL.items():
         c.execute(sql)
         print(f"✅ Table créée : {name}")
+    migrate(conn)  # index, colonnes et tables de cache
     # --- Insertion dépôt ---
     c.execute("""
         INSERT INTO depots (nom, num, rue, ville, zip)
@@ -0,0 +1,324 @@
+import math
+import requests
+
+from mods.profiling import count, timer
+
+ORS_MATRIX_URL = "https://api.openrouteservice.org/v2/matrix/driving-car"
+ORS_DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/driving-car/geojson"
+
+# Nombre maximal de points par requête ORS Directions
+ORS_MAX_WAYPOINTS = 50
+
+
+# ============================================================
+# Appels ORS
+# ============================================================
+
+def ors_matrix(coords, api_key, cluster_name="(unknown)", sources=None, destinations=None):
+    """Wrapper robuste pour l'appel ORS Matrix."""
+    headers = {"Authorization": api_key, "Content-Type": "application/json"}
+    body = {"locations": coords, "metrics": ["duration", "distance"], "units": "m"}
+    if sources is not None:
+        body["sources"] = sources
+    if destinations is not None:
+        body["destinations"] = destinations
+
+    count("ors.matrix.requests")
+    try:
+        with timer("ors.matrix"):
+            resp = requests.post(ORS_MATRIX_URL, json=body, headers=headers, timeout=30)
+    except requests.exceptions.Timeout:
+        print(f"[X] ORS timeout pour {cluster_name}")
+        return None
+    except Exception as e:
+        print(f"[X] Erreur ORS ({cluster_name}): {e}")
+        return None
+
+    if not resp.ok:
+        print(f"[X] ORS HTTP {resp.status_code} pour {cluster_name} : {resp.text[:200]}")
+        return None
+
+    try:
+        data = resp.json()
+    except Exception as e:
+        print(f"[X] Réponse ORS invalide ({cluster_name}): {e}")
+        return None
+
+    if "durations" not in data or "distances" not in data:
+        print(f"[X] ORS a renvoyé un JSON sans matrices ({cluster_name})")
+        return None
+
+    return data
+
+
+def ors_route_geometry(coords, API_key, label=""):
+    """
+    Géométrie routière complète d'une séquence de points [lon, lat] en un seul appel
+    ORS Directions (découpé par paquets de ORS_MAX_WAYPOINTS si nécessaire).
+    Retourne [[lon, lat], ...] ou None.
+    """
+    headers = {"Authorization": API_key, "Content-Type": "application/json"}
+    geometry = []
+    step = ORS_MAX_WAYPOINTS - 1
+    for start in range(0, len(coords) - 1, step):
+        chunk = coords[start:start + ORS_MAX_WAYPOINTS]
+        count("ors.directions.requests")
+        try:
+            with timer("ors.directions"):
+                resp = requests.post(ORS_DIRECTIONS_URL, json={"coordinates": chunk}, headers=headers, timeout=60)
+        except requests.exceptions.RequestException as e:
+            print(f"[X] Erreur ORS ({label}): {e}")
+            return None
+        if resp.status_code != 200:
+            print(f"[!] Erreur ORS {label}: {resp.text}")
+            return None
+        try:
+            data = resp.json()
+        except ValueError as e:
+            print(f"[X] Réponse ORS invalide ({label}): {e}")
+            return None
+        if "features" not in data:
+            print(f"[!] Pas de features pour {label}: {data}")
+            return None
+        part = data["features"][0]["geometry"]["coordinates"]
+        # Le premier point d'un paquet est le dernier du précédent
+        geometry.extend(part if not geometry else part[1:])
+    return geometry
+
+
+# ============================================================
+# Fournisseurs de routage
+# ============================================================
+
+class RoutingProvider:
+    """
+    Interface commune des moteurs de routage.
+    Les coordonnées sont au format ORS : [[lon, lat], ...].
+    """
+    profile = "unknown"   # Clé de cache (matrix_cache, route_geometry_cache)
+    cacheable = True      # False si le calcul local est plus rapide que le cache SQLite
+
+    def matrix(self, coords, sources=None, destinations=None, label=""):
+        """Retourne {"durations": [[s]], "distances": [[m]]} (sources x destinations) ou None."""
+        raise NotImplementedError
+
+    def directions(self, coords, label=""):
+        """Retourne la géométrie [[lon, lat], ...] passant par `coords` dans l'ordre, ou None."""
+        raise NotImplementedError
+
+
+class ORSProvider(RoutingProvider):
+    """Routage via l'API OpenRouteService (réseau)."""
+    profile = "driving-car"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def matrix(self, coords, sources=None, destinations=None, label=""):
+        return ors_matrix(coords, self.api_key, label or "(unknown)", sources, destinations)
+
+    def directions(self, coords, label=""):
+        return ors_route_geometry(coords, self.api_key, label)
+
+
+class HaversineProvider(RoutingProvider):
+    """
+    Repli hors-ligne : distance à vol d'oiseau x facteur de détour, à vitesse constante.
+    Aucune dépendance réseau, utile pour les tests et les benchmarks.
+    """
+    cacheable = False
+
+    def __init__(self, speed_kmh=50.0, detour_factor=1.3):
+        self.speed_kmh = speed_kmh
+        self.detour_factor = detour_factor
+        self.profile = f"haversine-{speed_kmh:g}-{detour_factor:g}"
+
+    def matrix(self, coords, sources=None, destinations=None, label=""):
+        import numpy as np
+        from mods.distance import pairwise_km
+        pts = np.asarray(coords, dtype=float)
+        src = pts if sources is None else pts[list(sources)]
+        dst = pts if destinations is None else pts[list(destinations)]
+        distances = pairwise_km(src[:, 1], src[:, 0], dst[:, 1], dst[:, 0]) * 1000.0 * self.detour_factor
+        durations = distances / (self.speed_kmh / 3.6)
+        return {"durations": durations.tolist(), "distances": distances.tolist()}
+
+    def directions(self, coords, label=""):
+        return [list(c) for c in coords]
+
+
+class LocalGraphProvider(RoutingProvider):
+    """
+    Routage hors-ligne sur un graphe routier local (extrait OSM converti).
+
+    Le graphe est un fichier .npz (voir save_graph) : coordonnées des noeuds et arcs
+    orientés avec longueur (m) et durée (s). Il est chargé en matrices CSR et les
+    matrices sont calculées par Dijkstra multi-sources (scipy.sparse.csgraph).
+    Les points sont rattachés au noeud le plus proche (KD-tree).
+    """
+
+    def __init__(self, graph_path):
+        self.graph_path = graph_path
+        self.profile = f"local-{graph_path}"
+        self._graph = None
+
+    def __getstate__(self):
+        # Le graphe est rechargé paresseusement dans chaque processus (pool TSP)
+        state = self.__dict__.copy()
+        state["_graph"] = None
+        return state
+
+    def _load(self):
+        if self._graph is None:
+            self._graph = load_graph(self.graph_path)
+        return self._graph
+
+    def _snap(self, coords):
+        graph = self._load()
+        import numpy as np
+        pts = np.asarray(coords, dtype=float)
+        scaled = np.column_stack([pts[:, 0] * graph["lon_scale"], pts[:, 1]])
+        _, nodes = graph["tree"].query(scaled)
+        return nodes
+
+    def _shortest(self, source_nodes):
+        from scipy.sparse.csgraph import dijkstra
+        graph = self._load()
+        return dijkstra(graph["durations"], directed=True, indices=source_nodes, return_predecessors=True)
+
+    def _path_lengths(self, predecessors):
+        """Longueur (m) du plus court chemin en temps vers chaque noeud, par saut de pointeurs."""
+        import numpy as np
+        graph = self._load()
+        n = graph["n_nodes"]
+        pred = predecessors.copy()
+        nodes = np.arange(n)
+        root = pred < 0
+        pred[root] = nodes[root]
+        length = np.zeros(n)
+        has_pred = ~root
+        length[has_pred] = np.asarray(graph["distances"][pred[has_pred], nodes[has_pred]]).ravel()
+        while True:
+            nxt = pred[pred]
+            if np.array_equal(nxt, pred):
+                break
+            length = length + length[pred]
+            pred = nxt
+        return length
+
+    def matrix(self, coords, sources=None, destinations=None, label=""):
+        import numpy as np
+        sources = list(range(len(coords))) if sources is None else list(sources)
+        destinations = list(range(len(coords))) if destinations is None else list(destinations)
+        nodes = self._snap(coords)
+        src_nodes = nodes[sources]
+        dst_nodes = nodes[destinations]
+
+        durations, predecessors = self._shortest(src_nodes)
+        durations = np.atleast_2d(durations)
+        predecessors = np.atleast_2d(predecessors)
+
+        dur_rows, dist_rows = [], []
+        for k in range(len(sources)):
+            row_dur = durations[k, dst_nodes]
+            row_dist = self._path_lengths(predecessors[k])[dst_nodes]
+            unreachable = ~np.isfinite(row_dur)
+            dur_rows.append([None if u else float(v) for v, u in zip(row_dur, unreachable)])
+            dist_rows.append([None if u else float(v) for v, u in zip(row_dist, unreachable)])
+        return {"durations": dur_rows, "distances": dist_rows}
+
+    def directions(self, coords, label=""):
+        import numpy as np
+        graph = self._load()
+        nodes = self._snap(coords)
+        _, predecessors = self._shortest(nodes[:-1])
+        predecessors = np.atleast_2d(predecessors)
+
+        geometry = [list(coords[0])]
+        for k in range(len(nodes) - 1):
+            path = [nodes[k + 1]]
+            while path[-1] != nodes[k]:
+                prev = predecessors[k, path[-1]]
+                if prev < 0:
+                    print(f"[!] Pas de chemin local {label}, étape {k}")
+                    return None
+                path.append(prev)
+            path.reverse()
+            geometry.extend([float(graph["lon"][n]), float(graph["lat"][n])] for n in path)
+        geometry.append(list(coords[-1]))
+        return geometry
+
+
+# ============================================================
+# Graphe local : format .npz
+# ============================================================
+
+def save_graph(path, node_lat, node_lon, edge_src, edge_dst, edge_length_m,
+               edge_duration_s=None, edge_speed_kmh=50.0):
+    """
+    Enregistre un graphe routier compact (.npz) pour LocalGraphProvider.
+    Les arcs sont orientés ; dupliquer (dst, src) pour les voies à double sens.
+    Si edge_duration_s est absent, il est déduit de edge_speed_kmh (scalaire ou par arc).
+    """
+    import numpy as np
+    edge_length_m = np.asarray(edge_length_m, dtype=float)
+    if edge_duration_s is None:
+        edge_duration_s = edge_length_m / (np.asarray(edge_speed_kmh, dtype=float) / 3.6)
+    np.savez_compressed(
+        path,
+        node_lat=np.asarray(node_lat, dtype=float),
+        node_lon=np.asarray(node_lon, dtype=float),
+        edge_src=np.asarray(edge_src, dtype=np.int64),
+        edge_dst=np.asarray(edge_dst, dtype=np.int64),
+        edge_length_m=edge_length_m,
+        edge_duration_s=np.asarray(edge_duration_s, dtype=float),
+    )
+
+
+def load_graph(path):
+    """Charge un graphe .npz en matrices CSR (durée, distance) + KD-tree des noeuds."""
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    from scipy.spatial import cKDTree
+
+    data = np.load(path)
+    lat, lon = data["node_lat"], data["node_lon"]
+    src, dst = data["edge_src"], data["edge_dst"]
+    n = len(lat)
+
+    # Arcs parallèles : on garde le plus rapide (tri décroissant, la dernière valeur gagne)
+    order = np.argsort(-data["edge_duration_s"])
+    src, dst = src[order], dst[order]
+    dur, length = data["edge_duration_s"][order], data["edge_length_m"][order]
+    keys = src * n + dst
+    _, last = np.unique(keys[::-1], return_index=True)
+    keep = len(keys) - 1 - last
+    src, dst, dur, length = src[keep], dst[keep], dur[keep], length[keep]
+
+    # Durée nulle = absence d'arc en CSR : on impose un epsilon
+    dur = np.maximum(dur, 1e-3)
+
+    lon_scale = math.cos(math.radians(float(np.mean(lat)))) if n else 1.0
+    return {
+        "n_nodes": n,
+        "lat": lat,
+        "lon": lon,
+        "lon_scale": lon_scale,
+        "durations": csr_matrix((dur, (src, dst)), shape=(n, n)),
+        "distances": csr_matrix((length, (src, dst)), shape=(n, n)),
+        "tree": cKDTree(np.column_stack([lon * lon_scale, lat])),
+    }
+
+
+def get_provider(name="ors", api_key=None, graph_path=None, speed_kmh=50.0):
+    """Fabrique un fournisseur depuis son nom : "ors", "local" ou "haversine"."""
+    name = (name or "ors").lower()
+    if name == "ors":
+        return ORSProvider(api_key)
+    if name == "local":
+        if not graph_path:
+            raise ValueError("graph_path requis pour le routage local")
+        return LocalGraphProvider(graph_path)
+    if name == "haversine":
+        return HaversineProvider(speed_kmh=speed_kmh)
+    raise ValueError(f"Fournisseur de routage inconnu : {name}")
@@ -1,48 +1,518 @@
-import sqlite3
-import requests
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, date, timedelta
 from ortools.constraint_solver import routing_enums_pb2, pywrapcp
 
+from mods.matrix_cache import cached_matrix
+from mods.migrations import migrate
+from mods.db import get_connection
+from mods.profiling import call_profiled, count, merge, record, timer
+from mods.routing import ORSProvider, ors_matrix  # noqa: F401 (ré-export)
+from mods.use_tools import time_offset_s
 
-def TSP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_limit_s=10, verbose=True):
+
+def fetch_matrix(db_path, provider, locations, label="", verbose=True):
+    """
+    Matrices durée/distance entre `locations` [(appt_id, lat, lon, ...), ...] :
+    via matrix_cache si le fournisseur est cacheable, sinon calcul direct.
+    """
+    coords = [[loc[2], loc[1]] for loc in locations]
+    if verbose:
+        print(f"  {len(coords)} points ({provider.profile}) pour {label}")
+
+    if not provider.cacheable:
+        return provider.matrix(coords, label=label)
+
+    conn = get_connection(db_path)
+    try:
+        return cached_matrix(
+            conn,
+            [(loc[1], loc[2]) for loc in locations],
+            lambda src, dst: provider.matrix(coords, src, dst, label),
+            profile=provider.profile,
+            verbose=verbose,
+        )
+    finally:
+        conn.close()
+
+
+def valid_coords(lat, lon):
+    """Coordonnées numériques et dans les bornes WGS84."""
+    return (
+        isinstance(lat, (float, int)) and isinstance(lon, (float, int))
+        and -90 <= lat <= 90 and -180 <= lon <= 180
+    )
+
+
+def window_columns_expr(c):
+    """Colonnes SQL (fixe, window_start, window_end) de appointments, NULL si absentes."""
+    c.execute("PRAGMA table_info(appointments)")
+    appt_cols = {row[1] for row in c.fetchall()}
+    return ", ".join(f"a.{col}" if col in appt_cols else "NULL" for col in ("fixe", "window_start", "window_end"))
+
+
+def duration_column(c):
+    """Détection de la colonne de durée de visite dans appointments."""
+    c.execute("PRAGMA table_info(appointments)")
+    appt_cols = [row[1] for row in c.fetchall()]
+    return next((col for col in ("duration_visit", "duration", "visit_duration", "service_duration") if col in appt_cols), None)
+
+
+# Horizon d'une journée de tournée (secondes depuis l'heure de départ)
+DAY_HORIZON_S = 24 * 3600
+
+
+def appointment_window(window_start, window_end, fixe, start_dt_base):
+    """
+    Fenêtre (début, fin) en secondes depuis start_dt_base, ou None si aucune contrainte.
+    Un RDV fixe commence exactement à window_start. Une borne renseignée mais inutilisable
+    (invalide, autre jour) fait ignorer toute la fenêtre.
+    """
+    ws = time_offset_s(window_start, start_dt_base)
+    we = time_offset_s(window_end, start_dt_base)
+    if (window_start and ws is None) or (window_end and we is None):
+        print(f"[!] Fenêtre inutilisable ({window_start} → {window_end}), ignorée")
+        return None
+    if fixe and ws is not None:
+        return max(ws, 0), max(ws, 0)
+    if ws is None and we is None:
+        return None
+    ws = max(ws or 0, 0)
+    we = DAY_HORIZON_S if we is None else min(we, DAY_HORIZON_S)
+    if we < ws:
+        print(f"[!] Fenêtre incohérente ({window_start} → {window_end}), ignorée")
+        return None
+    return ws, we
+
+
+def transit_matrix(matrix_time, service_s):
+    """Matrice entière (s) précalculée : trajet i→j + durée de visite en i."""
+    import numpy as np
+    travel = np.rint(np.asarray(matrix_time, dtype=float)).astype(np.int64)
+    return (travel + np.asarray(service_s, dtype=np.int64)[:, None]).tolist()
+
+
+def add_time_dimension(routing, manager, matrix_time, locations, native=True):
+    """
+    Dimension "Time" (secondes) : trajet + durée de visite du noeud de départ,
+    attente autorisée (slack) et fenêtres horaires appliquées aux cumuls.
+    locations : [(appt_id, lat, lon, visit_min, window), ...]
+    native=True : matrice entière précalculée enregistrée via RegisterTransitMatrix,
+    évaluée en C++ sans repasser par Python à chaque arc ; native=False : callback Python.
+    Retourne (dimension, index du callback de transit).
+    """
+    service_s = [int(loc[3]) * 60 for loc in locations]
+    transit = transit_matrix(matrix_time, service_s)
+
+    if native and hasattr(routing, "RegisterTransitMatrix"):
+        transit_callback_index = routing.RegisterTransitMatrix(transit)
+    else:
+        def time_callback(from_index, to_index):
+            f, t = manager.IndexToNode(from_index), manager.IndexToNode(to_index)
+            return transit[f][t]
+
+        transit_callback_index = routing.RegisterTransitCallback(time_callback)
+
+    routing.AddDimension(transit_callback_index, DAY_HORIZON_S, DAY_HORIZON_S, True, "Time")
+    time_dim = routing.GetDimensionOrDie("Time")
+
+    for node, loc in enumerate(locations):
+        window = loc[4] if len(loc) > 4 else None
+        if window is None or loc[0] is None:
+            continue
+        time_dim.CumulVar(manager.NodeToIndex(node)).SetRange(int(window[0]), int(window[1]))
+
+    return time_dim, transit_callback_index
+
+
+def read_route(routing, manager, solution, vehicle, time_dim):
+    """Noeuds visités par un véhicule (dépôts inclus) et heure de début de visite (s) de chacun."""
+    route, times = [], []
+    index = routing.Start(vehicle)
+    while True:
+        route.append(manager.IndexToNode(index))
+        times.append(solution.Min(time_dim.CumulVar(index)))
+        if routing.IsEnd(index):
+            break
+        index = solution.Value(routing.NextVar(index))
+    return route, times
+
+
+def cheapest_insertion(route, new_nodes, matrix_time):
+    """Insère chaque nouveau noeud là où il allonge le moins la route (dépôts aux extrémités)."""
+    route = list(route)
+    for node in new_nodes:
+        best_pos, best_cost = 1, None
+        for pos in range(1, len(route)):
+            a, b = route[pos - 1], route[pos]
+            cost = matrix_time[a][node] + matrix_time[node][b] - matrix_time[a][b]
+            if best_cost is None or cost < best_cost:
+                best_pos, best_cost = pos, cost
+        route.insert(best_pos, node)
+    return route
+
+
+def warm_start_route(locations, previous_appt_ids, matrix_time):
+    """
+    Route initiale (noeuds, dépôts inclus) à partir de la séquence précédente :
+    RDV retirés ignorés, nouveaux RDV insérés au moindre coût.
+    """
+    node_of = {loc[0]: node for node, loc in enumerate(locations) if loc[0] is not None}
+    kept = [node_of[a] for a in previous_appt_ids if a in node_of]
+    new_nodes = [node for a, node in node_of.items() if node not in set(kept)]
+    return cheapest_insertion([0] + kept + [len(locations) - 1], new_nodes, matrix_time)
+
+
+# ============================================================
+# Budget de temps du solveur
+# ============================================================
+
+# Jusqu'à ce nombre de RDV (sans fenêtre), la tournée optimale est calculée exactement
+EXACT_MAX_STOPS = 8
+
+
+def held_karp(transit):
+    """
+    Tournée optimale dépôt → RDV → dépôt par programmation dynamique (Held-Karp),
+    O(2^n · n²) : réservé aux petits clusters (n <= EXACT_MAX_STOPS).
+    transit : matrice entière, noeud 0 = départ, dernier noeud = retour.
+    Retourne la liste des noeuds visités, dépôts inclus.
+    """
+    n = len(transit) - 2
+    end = n + 1
+    full = (1 << n) - 1
+    inf = float("inf")
+    cost = [[inf] * n for _ in range(1 << n)]
+    parent = [[-1] * n for _ in range(1 << n)]
+    for k in range(n):
+        cost[1 << k][k] = transit[0][k + 1]
+
+    for mask in range(1, 1 << n):
+        for k in range(n):
+            c = cost[mask][k]
+            if c == inf:
+                continue
+            for j in range(n):
+                if mask & (1 << j):
+                    continue
+                nxt = mask | (1 << j)
+                cand = c + transit[k + 1][j + 1]
+                if cand < cost[nxt][j]:
+                    cost[nxt][j] = cand
+                    parent[nxt][j] = k
+
+    k = min(range(n), key=lambda last: cost[full][last] + transit[last + 1][end])
+    mask, route = full, []
+    while k != -1:
+        route.append(k + 1)
+        mask, k = mask ^ (1 << k), parent[mask][k]
+    return [0] + route[::-1] + [end]
+
+
+def adaptive_time_limit_s(n_stops, base_s=1.0, per_stop_s=0.25, max_s=60.0):
+    """Limite de temps proportionnelle à la taille du cluster."""
+    return min(max_s, base_s + per_stop_s * n_stops)
+
+
+def allocate_time_budget(sizes, total_s, min_s=0.5, max_s=60.0):
+    """
+    Répartit un budget global (secondes de solveur) entre clusters au prorata du nombre de RDV.
+    sizes : {cluster_name: nb de RDV} des clusters à confier à OR-Tools.
+    """
+    total_stops = sum(sizes.values())
+    if not total_stops:
+        return {}
+    return {
+        name: min(max_s, max(min_s, total_s * n / total_stops))
+        for name, n in sizes.items()
+    }
+
+
+def solve_exact(locations, matrix_time):
+    """Route et heures de visite (s) exactes pour un petit cluster sans fenêtre horaire."""
+    service_s = [int(loc[3]) * 60 for loc in locations]
+    transit = transit_matrix(matrix_time, service_s)
+    route = held_karp(transit)
+    times = [0]
+    for a, b in zip(route, route[1:]):
+        times.append(times[-1] + transit[a][b])
+    return route, times
+
+
+def has_windows(locations):
+    return any(len(loc) > 4 and loc[4] is not None for loc in locations)
+
+
+def stop_on_plateau(routing, plateau_s):
+    """
+    Moniteur de recherche : interrompt la recherche si l'objectif ne s'est pas
+    amélioré depuis plateau_s secondes (évalué à chaque nouvelle solution).
+    """
+    solver = routing.solver()
+    state = {"best": None, "since": time.monotonic()}
+
+    def on_solution():
+        cost = routing.CostVar().Max()
+        now = time.monotonic()
+        if state["best"] is None or cost < state["best"]:
+            state["best"], state["since"] = cost, now
+        elif now - state["since"] > plateau_s:
+            solver.FinishCurrentSearch()
+
+    routing.AddAtSolutionCallback(on_solution)
+
+
+def record_solver_stats(routing, solution, prefix):
+    """Solutions trouvées, branches explorées et coût final d'une recherche OR-Tools (mods.profiling)."""
+    solver = routing.solver()
+    count(f"{prefix}.solutions", solver.Solutions())
+    count(f"{prefix}.branches", solver.Branches())
+    count(f"{prefix}.objective", solution.ObjectiveValue())
+
+
+def solve_cluster(db_path, provider, cluster_name, locations, ortools_time_limit_s=10, verbose=True,
+                  previous_route=None, warm_time_limit_ms=500, exact_max_stops=0, plateau_s=None):
+    """
+    Matrice + résolution OR-Tools pour un cluster.
+    provider : RoutingProvider (ORS, graphe local, haversine...).
+    locations : [(appt_id, lat, lon, visit_min, window), ...] avec le dépôt en premier et en dernier ;
+    window = (début, fin) en secondes depuis l'heure de départ, ou None.
+    Fonction de module (picklable) pour pouvoir tourner dans un ProcessPoolExecutor :
+    elle n'écrit que dans matrix_cache, les itinéraires sont insérés par l'appelant.
+    previous_route : appt_id dans l'ordre de l'itinéraire précédent ; si fourni, la recherche
+    part de cette séquence complétée par insertion (ReadAssignmentFromRoutes) et est limitée
+    à warm_time_limit_ms.
+    exact_max_stops : en dessous (RDV sans fenêtre), résolution exacte sans OR-Tools.
+    plateau_s : arrêt anticipé si aucune amélioration depuis plateau_s secondes.
+    ortools_time_limit_s peut être fractionnaire.
+    Retourne {"cluster_name", "route", "times", "durations", "distances", "dropped"} ou None.
+    """
+    with timer("tsp.matrix"):
+        data = fetch_matrix(db_path, provider, locations, cluster_name, verbose)
+    if not data:
+        print(f"[X] Échec du calcul de matrice pour {cluster_name}, passage au suivant.")
+        return None
+
+    matrix_time = data["durations"]
+    size = len(locations)
+
+    if size - 2 <= exact_max_stops and not has_windows(locations):
+        with timer("tsp.exact"):
+            route, times = solve_exact(locations, matrix_time)
+        count("tsp.clusters.exact")
+        if verbose:
+            print(f"  {cluster_name} : tournée exacte ({size - 2} RDV)")
+        return {
+            "cluster_name": cluster_name,
+            "route": route,
+            "times": times,
+            "durations": matrix_time,
+            "distances": data["distances"],
+            "dropped": [],
+        }
+
+    # --- OR-Tools ---
+    manager = pywrapcp.RoutingIndexManager(size, 1, [0], [size - 1])
+    routing = pywrapcp.RoutingModel(manager)
+
+    time_dim, transit_callback_index = add_time_dimension(routing, manager, matrix_time, locations)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # Avec des fenêtres, un RDV impossible à caser est abandonné (forte pénalité)
+    # plutôt que de rendre tout le cluster infaisable
+    if has_windows(locations):
+        for node in range(1, size - 1):
+            routing.AddDisjunction([manager.NodeToIndex(node)], 10**7)
+
+    search_params = pywrapcp.DefaultRoutingSearchParameters()
+    search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    search_params.time_limit.FromMilliseconds(int(ortools_time_limit_s * 1000))
+    if plateau_s:
+        stop_on_plateau(routing, plateau_s)
+
+    solution = None
+    if previous_route is not None:
+        # Démarrage à chaud depuis la séquence précédente
+        search_params.time_limit.FromMilliseconds(warm_time_limit_ms)
+        routing.CloseModelWithParameters(search_params)
+        initial = warm_start_route(locations, previous_route, matrix_time)
+        assignment = routing.ReadAssignmentFromRoutes([initial[1:-1]], True)
+        if assignment:
+            with timer("tsp.solve"):
+                solution = routing.SolveFromAssignmentWithParameters(assignment, search_params)
+            count("tsp.clusters.warm_start")
+        else:
+            print(f"[!] Séquence précédente inutilisable pour {cluster_name}, résolution complète")
+            search_params.time_limit.FromMilliseconds(int(ortools_time_limit_s * 1000))
+
+    if not solution:
+        with timer("tsp.solve"):
+            solution = routing.SolveWithParameters(search_params)
+    if not solution:
+        print(f"[X] OR-Tools n’a pas trouvé de solution pour {cluster_name}")
+        return None
+    count("tsp.clusters.ortools")
+    record_solver_stats(routing, solution, "tsp")
+
+    # Ordre des noeuds visités, dépôt de départ et d'arrivée inclus
+    route, times = read_route(routing, manager, solution, 0, time_dim)
+    dropped = [locations[node][0] for node in range(1, size - 1) if node not in set(route)]
+    if dropped:
+        print(f"[!] RDV hors fenêtre non planifiés pour {cluster_name} : {dropped}")
+
+    return {
+        "cluster_name": cluster_name,
+        "route": route,
+        "times": times,
+        "durations": matrix_time,
+        "distances": data["distances"],
+        "dropped": dropped,
+    }
+
+
+def build_itinerary_rows(cluster_id, locations, result, start_dt_base):
+    """
+    Transforme une route résolue en lignes pour la table itineraries.
+    Si result["times"] (début de visite calculé par le solveur) est présent, l'attente
+    éventuelle est placée avant le départ : depart_time = arrivée - trajet.
+    """
+    matrix_time = result["durations"]
+    matrix_dist = result["distances"]
+    route = result["route"]
+    times = result.get("times")
+
+    prev_node = route[0]
+    seq = 0
+    depart_dt = start_dt_base
+    inserts = []
+
+    for pos, node in enumerate(route[1:-1], start=1):
+        appt_id = locations[node][0]
+        visit_dur = locations[node][3]
+        travel_s = matrix_time[prev_node][node]
+        dist_m = matrix_dist[prev_node][node]
+
+        if times:
+            arrive_dt = start_dt_base + timedelta(seconds=times[pos])
+            depart_dt = arrive_dt - timedelta(seconds=int(travel_s))
+        else:
+            arrive_dt = depart_dt + timedelta(seconds=travel_s)
+        depart_next = arrive_dt + timedelta(minutes=visit_dur)
+
+        inserts.append((
+            cluster_id,
+            appt_id,
+            seq,
+            depart_dt.isoformat(timespec="seconds"),
+            arrive_dt.isoformat(timespec="seconds"),
+            visit_dur,
+            int(travel_s // 60),
+            dist_m / 1000.0,
+        ))
+
+        prev_node = node
+        depart_dt = depart_next
+        seq += 1
+
+    # Dernier segment retour au dépôt
+    last_node = route[-1]
+    travel_s = matrix_time[prev_node][last_node]
+    dist_m = matrix_dist[prev_node][last_node]
+    arrive_dt = depart_dt + timedelta(seconds=travel_s)
+
+    inserts.append((
+        cluster_id,
+        None,
+        seq,
+        depart_dt.isoformat(timespec="seconds"),
+        arrive_dt.isoformat(timespec="seconds"),
+        0,
+        int(travel_s // 60),
+        dist_m / 1000.0,
+    ))
+    return inserts
+
+
+ITINERARY_STATE_SQL = """
+    CREATE TABLE IF NOT EXISTS itinerary_state (
+        cluster_name TEXT PRIMARY KEY,
+        cluster_id INTEGER,
+        members_hash TEXT NOT NULL,
+        updated_at TEXT
+    )
+"""
+
+
+def members_hash(locations, *extra):
+    """Empreinte du contenu d'un cluster (RDV, coordonnées, durées, fenêtres) + paramètres."""
+    payload = "|".join(str(e) for e in extra) + "|" + ";".join(
+        f"{appt_id}:{lat:.5f},{lon:.5f}:{visit}:{window}"
+        for appt_id, lat, lon, visit, window in sorted(locations, key=lambda loc: (loc[0] is not None, loc[0] or 0))
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def remap_itineraries(conn):
+    """
+    Après un nouveau clustering (ids de clusters supprimés puis réattribués) :
+    ré-associe en une passe l'itinéraire de chaque cluster encore présent (par cluster_name,
+    via itinerary_state) à son nouvel id. Les itinéraires modifiés restent en place jusqu'à
+    leur réécriture : un cluster dont la résolution échoue garde sa tournée précédente.
+    Seuls les itinéraires de clusters disparus sont supprimés.
+    Les ids pouvant être réutilisés par un autre cluster, rien n'est modifié ligne à ligne.
+    """
+    c = conn.cursor()
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS itinerary_remap (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)")
+    c.execute("DELETE FROM temp.itinerary_remap")
+    c.execute("""
+        INSERT OR IGNORE INTO temp.itinerary_remap (old_id, new_id)
+        SELECT s.cluster_id, MIN(cl.id)
+        FROM itinerary_state s
+        JOIN clusters cl ON cl.cluster_name = s.cluster_name
+        GROUP BY s.cluster_name
+    """)
+    c.execute("DELETE FROM itineraries WHERE cluster_id NOT IN (SELECT old_id FROM temp.itinerary_remap)")
+    c.execute("""
+        UPDATE itineraries
+        SET cluster_id = (SELECT new_id FROM temp.itinerary_remap WHERE old_id = itineraries.cluster_id)
+    """)
+    c.execute("""
+        UPDATE itinerary_state
+        SET cluster_id = (SELECT MIN(id) FROM clusters WHERE cluster_name = itinerary_state.cluster_name)
+        WHERE cluster_name IN (SELECT cluster_name FROM clusters)
+    """)
+    conn.commit()
+
+
+def TSP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_limit_s=10, verbose=True, workers=1,
+        provider=None, incremental=False, warm_time_limit_ms=500, time_policy="fixed", total_time_budget_s=None):
     """
     Résout le TSP pour chaque cluster de la base SQLite.
     Ajout de robustesse sur la vérification des coordonnées et l'appel ORS.
+    Les matrices sont assemblées depuis la table matrix_cache : seules les paires
+    origine/destination inconnues sont demandées à ORS.
+    workers > 1 : matrice + résolution de chaque cluster dans un pool de processus,
+    les insertions dans itineraries restent faites ici par un seul écrivain.
+    provider : RoutingProvider à utiliser (ORS avec API_key par défaut).
+    incremental=True : les clusters dont le contenu n'a pas changé (itinerary_state) sont
+    conservés tels quels ; les autres repartent de leur séquence précédente (démarrage à chaud,
+    limité à warm_time_limit_ms) au lieu d'une résolution complète.
+    time_policy="fixed" : ortools_time_limit_s pour chaque cluster (historique) ;
+    "adaptive" : tournée exacte jusqu'à EXACT_MAX_STOPS RDV, limite proportionnelle à la taille
+    au-delà (plafonnée par ortools_time_limit_s) et arrêt sur plateau de l'objectif.
+    total_time_budget_s : budget global de secondes solveur réparti entre clusters au prorata
+    des RDV (avec workers > 1, la durée réelle est d'environ budget / workers).
     """
-    def ors_matrix(coords, api_key, cluster_name="(unknown)"):
-        """Wrapper robuste pour l'appel ORS Matrix."""
-        ors_url = "https://api.openrouteservice.org/v2/matrix/driving-car"
-        headers = {"Authorization": api_key, "Content-Type": "application/json"}
-        body = {"locations": coords, "metrics": ["duration", "distance"], "units": "m"}
-
-        try:
-            resp = requests.post(ors_url, json=body, headers=headers, timeout=30)
-        except requests.exceptions.Timeout:
-            print(f"[X] ORS timeout pour {cluster_name}")
-            return None
-        except Exception as e:
-            print(f"[X] Erreur ORS ({cluster_name}): {e}")
-            return None
-
-        if not resp.ok:
-            print(f"[X] ORS HTTP {resp.status_code} pour {cluster_name} : {resp.text[:200]}")
-            return None
-
-        try:
-            data = resp.json()
-        except Exception as e:
-            print(f"[X] Réponse ORS invalide ({cluster_name}): {e}")
-            return None
-
-        if "durations" not in data or "distances" not in data:
-            print(f"[X] ORS a renvoyé un JSON sans matrices ({cluster_name})")
-            return None
-
-        return data
+    if time_policy not in ("fixed", "adaptive"):
+        raise ValueError(f"Politique de temps inconnue : {time_policy} (fixed, adaptive)")
+    provider = provider or ORSProvider(API_key)
 
     # --- Connexion DB ---
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path)
     c = conn.cursor()
+    c.execute(ITINERARY_STATE_SQL)
 
     # --- Dépôt ---
     c.execute("SELECT lat, lon FROM depots LIMIT 1")
@@ -53,10 +523,10 @@ def TSP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_lim
         return
     depot_lat, depot_lon = depot
 
-    # --- Détection de la colonne de durée ---
-    c.execute("PRAGMA table_info(appointments)")
-    appt_cols = [row[1] for row in c.fetchall()]
-    duration_col = next((col for col in ("duration_visit", "duration", "visit_duration", "service_duration") if col in appt_cols), None)
+    # --- Détection des colonnes de durée et de fenêtre horaire ---
+    duration_col = duration_column(c)
+    visit_expr = f"COALESCE(a.{duration_col}, ?)" if duration_col else "?"
+    window_expr = window_columns_expr(c)
 
     # --- Récupération des clusters ---
     c.execute("SELECT DISTINCT cluster_name FROM clusters")
@@ -69,28 +539,22 @@ def TSP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_lim
         start_dt_time = datetime.strptime("08:00", "%H:%M").time()
     start_dt_base = datetime.combine(date.today(), start_dt_time)
 
-    # --- Boucle clusters ---
+    # --- Préparation des clusters ---
+    tasks = {}
+    hashes = {}
+    previous_routes = {}  # cluster_name -> séquence d'appt_id précédente
     for cluster_name in cluster_names:
         if verbose:
             print(f"\n--- Traitement {cluster_name} ---")
 
         # Récupération des RDV du cluster
-        if duration_col:
-            c.execute(f"""
-                SELECT a.id, l.lat, l.lon, COALESCE(a.{duration_col}, ?) 
-                FROM clusters cl
-                JOIN appointments a ON cl.appt_id = a.id
-                JOIN locations l ON a.id = l.appt_id
-                WHERE cl.cluster_name = ?
-            """, (default_visit, cluster_name))
-        else:
-            c.execute("""
-                SELECT a.id, l.lat, l.lon, ?
-                FROM clusters cl
-                JOIN appointments a ON cl.appt_id = a.id
-                JOIN locations l ON a.id = l.appt_id
-                WHERE cl.cluster_name = ?
-            """, (default_visit, cluster_name))
+        c.execute(f"""
+            SELECT a.id, l.lat, l.lon, {visit_expr}, {window_expr}
+            FROM clusters cl
+            JOIN appointments a ON cl.appt_id = a.id
+            JOIN locations l ON a.id = l.appt_id
+            WHERE cl.cluster_name = ?
+        """, (default_visit, cluster_name))
 
         rows = c.fetchall()
         if not rows:
@@ -98,12 +562,15 @@ def TSP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_lim
             continue
 
         # Construction des points
-        appts = [(r[0], r[1], r[2], int(r[3])) for r in rows]
-        locations = [(None, depot_lat, depot_lon, 0)] + appts + [(None, depot_lat, depot_lon, 0)]
+        appts = [
+            (r[0], r[1], r[2], int(r[3]), appointment_window(r[5], r[6], r[4], start_dt_base))
+            for r in rows
+        ]
+        locations = [(None, depot_lat, depot_lon, 0, None)] + appts + [(None, depot_lat, depot_lon, 0, None)]
 
         # Filtrage des coordonnées invalides
         print(f"--- Diagnostic des coordonnées pour {cluster_name} ---")
-        for (appt_id, lat, lon, dur) in locations:
+        for (appt_id, lat, lon, dur, _) in locations:
             status = "OK"
             if lat is None or lon is None:
                 status = "❌ None"
@@ -116,12 +583,9 @@ def TSP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_lim
             print(f"id={appt_id}, lat={lat}, lon={lon}, {status}")
 
         filtered_locations = []
-        for (appt_id, lat, lon, dur) in locations:
-            if (
-                isinstance(lat, (float, int)) and isinstance(lon, (float, int))
-                and -90 <= lat <= 90 and -180 <= lon <= 180
-            ):
-                filtered_locations.append((appt_id, lat, lon, dur))
+        for (appt_id, lat, lon, dur, window) in locations:
+            if valid_coords(lat, lon):
+                filtered_locations.append((appt_id, lat, lon, dur, window))
             else:
                 print(f"[!] Coordonnée invalide ignorée : id={appt_id}, lat={lat}, lon={lon}")
 
@@ -129,42 +593,76 @@ def TSP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_lim
             print(f"[!] Cluster {cluster_name} ignoré : trop peu de points valides ({len(filtered_locations)})")
             continue
 
-        # Préparer coords pour ORS
-        coords = [[lon, lat] for (_, lat, lon, _) in filtered_locations]
-        if verbose:
-            print(f"  {len(coords)} points à envoyer à ORS")
-
-        # Récupérer la matrice ORS
-        data = ors_matrix(coords, API_key, cluster_name)
-        if not data:
-            print(f"[X] Échec ORS pour {cluster_name}, passage au suivant.")
-            continue
-
-        matrix_time = data["durations"]
-        matrix_dist = data["distances"]
-
-        # --- OR-Tools ---
-        size = len(filtered_locations)
-        manager = pywrapcp.RoutingIndexManager(size, 1, 0)
-        routing = pywrapcp.RoutingModel(manager)
-
-        def time_callback(from_index, to_index):
-            f, t = manager.IndexToNode(from_index), manager.IndexToNode(to_index)
-            return int(matrix_time[f][t])
-
-        transit_callback_index = routing.RegisterTransitCallback(time_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-        routing.AddDimension(transit_callback_index, 0, 10**9, True, "Time")
-
-        search_params = pywrapcp.DefaultRoutingSearchParameters()
-        search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        search_params.time_limit.FromSeconds(ortools_time_limit_s)
-
-        solution = routing.SolveWithParameters(search_params)
-        if not solution:
-            print(f"[X] OR-Tools n’a pas trouvé de solution pour {cluster_name}")
+        c.execute("SELECT id FROM clusters WHERE cluster_name = ? LIMIT 1", (cluster_name,))
+        cluster_id = c.fetchone()[0]
+        hashes[cluster_name] = members_hash(filtered_locations, start_hour, provider.profile)
+
+        if incremental:
+            c.execute("SELECT cluster_id, members_hash FROM itinerary_state WHERE cluster_name = ?", (cluster_name,))
+            state = c.fetchone()
+            if state:
+                old_cluster_id, old_hash = state
+                c.execute("SELECT appt_id FROM itineraries WHERE cluster_id = ? ORDER BY sequence", (old_cluster_id,))
+                previous = [r[0] for r in c.fetchall()]
+                if previous and old_hash == hashes[cluster_name]:
+                    # Contenu inchangé : itinéraire conservé (ré-associé plus bas si l'id du cluster a changé)
+                    print(f"= {cluster_name} inchangé, itinéraire conservé")
+                    count("tsp.clusters.unchanged")
+                    continue
+                if previous:
+                    previous_routes[cluster_name] = [a for a in previous if a is not None]
+
+        tasks[cluster_name] = filtered_locations
+
+    if incremental:
+        remap_itineraries(conn)
+
+    # --- Budget de temps par cluster ---
+    adaptive = time_policy == "adaptive"
+    exact_max_stops = EXACT_MAX_STOPS if adaptive else 0
+    solver_sizes = {
+        name: len(locs) - 2 for name, locs in tasks.items()
+        if not (len(locs) - 2 <= exact_max_stops and not has_windows(locs))
+    }
+    if total_time_budget_s is not None:
+        limits = allocate_time_budget(solver_sizes, total_time_budget_s, max_s=ortools_time_limit_s)
+    elif adaptive:
+        limits = {name: adaptive_time_limit_s(n, max_s=ortools_time_limit_s) for name, n in solver_sizes.items()}
+    else:
+        limits = {}
+
+    def solve_args(cluster_name):
+        limit = limits.get(cluster_name, ortools_time_limit_s)
+        return (
+            db_path, provider, cluster_name, tasks[cluster_name], limit, verbose,
+            previous_routes.get(cluster_name), warm_time_limit_ms,
+            exact_max_stops, max(0.5, limit / 4) if adaptive else None,
+        )
+
+    # --- Résolution (séquentielle ou en parallèle) ---
+    def results():
+        if workers <= 1 or len(tasks) <= 1:
+            for cluster_name in tasks:
+                yield solve_cluster(*solve_args(cluster_name))
+            return
+
+        # Mesures prises dans les processus de calcul, renvoyées avec le résultat
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(call_profiled, solve_cluster, *solve_args(cluster_name)) for cluster_name in tasks]
+            for future in as_completed(futures):
+                try:
+                    result, measures = future.result()
+                    merge(measures)
+                    yield result
+                except Exception as e:
+                    print(f"[X] Erreur pendant la résolution d'un cluster : {e}")
+                    yield None
+
+    # --- Écriture des itinéraires (écrivain unique) ---
+    for result in results():
+        if not result:
             continue
+        cluster_name = result["cluster_name"]
 
         # --- Récupérer cluster_id ---
         c.execute("SELECT id FROM clusters WHERE cluster_name = ? LIMIT 1", (cluster_name,))
@@ -175,70 +673,262 @@ def TSP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_lim
         cluster_id = row[0]
         c.execute("DELETE FROM itineraries WHERE cluster_id = ?", (cluster_id,))
 
-        # --- Parcours de la solution ---
-        index = routing.Start(0)
-        prev_node = 0
-        seq = 0
-        depart_dt = start_dt_base
-        inserts = []
-
-        while not routing.IsEnd(index):
-            node = manager.IndexToNode(index)
-            if node == 0:
-                index = solution.Value(routing.NextVar(index))
-                continue
+        inserts = build_itinerary_rows(cluster_id, tasks[cluster_name], result, start_dt_base)
 
-            appt_id = filtered_locations[node][0]
-            visit_dur = filtered_locations[node][3]
-            travel_s = matrix_time[prev_node][node]
-            dist_m = matrix_dist[prev_node][node]
+        # --- Insertion ---
+        with timer("db.itineraries"):
+            c.executemany("""
+                INSERT INTO itineraries
+                (cluster_id, appt_id, sequence, depart_time, arrive_time,
+                 duration_visit, travel_time_prev, distance_prev)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, inserts)
+            c.execute("""
+                INSERT OR REPLACE INTO itinerary_state (cluster_name, cluster_id, members_hash, updated_at)
+                VALUES (?, ?, ?, ?)
+            """, (cluster_name, cluster_id, hashes[cluster_name], datetime.now().isoformat(timespec="seconds")))
+            conn.commit()
+        count("rows.itineraries", len(inserts))
 
-            arrive_dt = depart_dt + timedelta(seconds=travel_s)
-            depart_next = arrive_dt + timedelta(minutes=visit_dur)
-
-            inserts.append((
-                cluster_id,
-                appt_id,
-                seq,
-                depart_dt.isoformat(timespec="seconds"),
-                arrive_dt.isoformat(timespec="seconds"),
-                visit_dur,
-                int(travel_s // 60),
-                dist_m / 1000.0,
-            ))
-
-            prev_node = node
-            depart_dt = depart_next
-            seq += 1
-            index = solution.Value(routing.NextVar(index))
-
-        # Dernier segment retour au dépôt
-        last_node = manager.IndexToNode(index)
-        travel_s = matrix_time[prev_node][last_node]
-        dist_m = matrix_dist[prev_node][last_node]
-        arrive_dt = depart_dt + timedelta(seconds=travel_s)
+        print(f"✅ Itinéraire enregistré pour {cluster_name} ({len(inserts)} étapes)")
 
-        inserts.append((
-            cluster_id,
-            None,
-            seq,
-            depart_dt.isoformat(timespec="seconds"),
-            arrive_dt.isoformat(timespec="seconds"),
-            0,
-            int(travel_s // 60),
-            dist_m / 1000.0,
-        ))
+    conn.close()
+    record("tsp.clusters.total", len(hashes))
+    print("\nTSP résolution terminée.")
 
-        # --- Insertion ---
+
+# ============================================================
+# VRP multi-dépôts / multi-véhicules
+# ============================================================
+
+def solve_vrp(db_path, provider, label, depots, appts, vehicle_depots, capacity,
+              ortools_time_limit_s=30, verbose=True):
+    """
+    Un seul modèle OR-Tools pour plusieurs véhicules partant chacun de leur dépôt.
+    depots : [(depot_id, nom, lat, lon), ...] ; appts : [(appt_id, lat, lon, visit_min, window), ...]
+    vehicle_depots : index du dépôt (dans `depots`) de chaque véhicule.
+    Noeuds : dépôts d'abord, puis RDV ; matrice partagée par tous les véhicules.
+    Retourne {"routes", "times" (par véhicule), "locations", "durations", "distances", "dropped"} ou None.
+    """
+    locations = [(None, lat, lon, 0, None) for (_, _, lat, lon) in depots] + list(appts)
+    with timer("vrp.matrix"):
+        data = fetch_matrix(db_path, provider, locations, label, verbose)
+    if not data:
+        print(f"[X] Échec du calcul de matrice pour {label}")
+        return None
+    matrix_time = data["durations"]
+
+    n_depots = len(depots)
+    manager = pywrapcp.RoutingIndexManager(len(locations), len(vehicle_depots),
+                                           list(vehicle_depots), list(vehicle_depots))
+    routing = pywrapcp.RoutingModel(manager)
+
+    time_dim, transit_callback_index = add_time_dimension(routing, manager, matrix_time, locations)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # Capacité : nombre de RDV par véhicule
+    demand_index = routing.RegisterUnaryTransitVector([0] * n_depots + [1] * (len(locations) - n_depots))
+    routing.AddDimensionWithVehicleCapacity(demand_index, 0, [capacity] * len(vehicle_depots), True, "Capacity")
+
+    # Un RDV peut être abandonné (forte pénalité) plutôt que de rendre le modèle infaisable
+    penalty = 10**7
+    for node in range(n_depots, len(locations)):
+        routing.AddDisjunction([manager.NodeToIndex(node)], penalty)
+
+    search_params = pywrapcp.DefaultRoutingSearchParameters()
+    search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    search_params.time_limit.FromSeconds(ortools_time_limit_s)
+
+    with timer("vrp.solve"):
+        solution = routing.SolveWithParameters(search_params)
+    if not solution:
+        print(f"[X] OR-Tools n’a pas trouvé de solution pour {label}")
+        return None
+    record_solver_stats(routing, solution, "vrp")
+
+    routes, times, visited = [], [], set()
+    for vehicle in range(len(vehicle_depots)):
+        route, route_times = read_route(routing, manager, solution, vehicle, time_dim)
+        routes.append(route)
+        times.append(route_times)
+        visited.update(route)
+
+    dropped = [locations[node][0] for node in range(n_depots, len(locations)) if node not in visited]
+    return {
+        "routes": routes,
+        "times": times,
+        "locations": locations,
+        "durations": matrix_time,
+        "distances": data["distances"],
+        "dropped": dropped,
+    }
+
+
+# Cluster des RDV non planifiés par le VRP global (use_clusters=False)
+UNPLANNED_CLUSTER = "Non planifiés"
+
+
+def vrp_cluster_name(day, depot_id, depot_nom):
+    """Nom d'un cluster produit par le VRP : unique par (jour, dépôt), même si deux voyageurs ont le même nom."""
+    return f"{day} - {depot_nom} #{depot_id}"
+
+
+def vrp_base_day(cluster_name, depot_id, depot_nom):
+    """Jour d'origine d'un cluster (nom sans le suffixe ajouté par vrp_cluster_name)."""
+    if depot_id is None:
+        return cluster_name
+    suffix = vrp_cluster_name("", depot_id, depot_nom)
+    return cluster_name[:-len(suffix)] if cluster_name.endswith(suffix) and cluster_name != suffix else cluster_name
+
+
+def VRP(db_path, API_key, start_hour="08:00", default_visit=60, ortools_time_limit_s=30, verbose=True,
+        capacity=6, use_clusters=True, provider=None):
+    """
+    Planification multi-dépôts : chaque voyageur (dépôt) est un véhicule avec son propre
+    départ/retour, l'affectation des RDV et leur ordre sont résolus ensemble.
+    - use_clusters=True : un modèle par cluster existant (jour), réparti entre les voyageurs.
+    - use_clusters=False : remplace clustering() ; un seul modèle avec
+      (nb voyageurs x nb jours) véhicules de `capacity` RDV.
+    Les clusters résolus sont réécrits ("<jour> - <voyageur> #<depot_id>", avec depot_id ; une
+    nouvelle exécution regroupe par jour d'origine) ainsi que leurs
+    itinéraires ; un cluster dont la résolution échoue reste inchangé, et les RDV non planifiés
+    restent dans un cluster sans itinéraire (le cluster d'origine, ou UNPLANNED_CLUSTER).
+    """
+    provider = provider or ORSProvider(API_key)
+
+    conn = get_connection(db_path)
+    c = conn.cursor()
+    migrate(conn, verbose=False)  # clusters.depot_id
+
+    # --- Voyageurs (dépôts géocodés) ---
+    c.execute("SELECT id, nom, lat, lon FROM depots")
+    depots = [d for d in c.fetchall() if valid_coords(d[2], d[3])]
+    if not depots:
+        print("/!\\ Aucun dépôt géocodé trouvé.")
+        conn.close()
+        return
+
+    # --- Heure de départ ---
+    try:
+        start_dt_time = datetime.strptime(start_hour, "%H:%M").time()
+    except Exception:
+        start_dt_time = datetime.strptime("08:00", "%H:%M").time()
+    start_dt_base = datetime.combine(date.today(), start_dt_time)
+
+    # --- RDV géocodés ---
+    duration_col = duration_column(c)
+    visit_expr = f"COALESCE(a.{duration_col}, ?)" if duration_col else "?"
+    window_expr = window_columns_expr(c)
+    if use_clusters:
+        c.execute(f"""
+            SELECT cl.cluster_name, cl.depot_id, d.nom, a.id, l.lat, l.lon, {visit_expr}, {window_expr}
+            FROM clusters cl
+            JOIN appointments a ON cl.appt_id = a.id
+            JOIN locations l ON a.id = l.appt_id
+            LEFT JOIN depots d ON d.id = cl.depot_id
+            WHERE l.lat IS NOT NULL AND l.lon IS NOT NULL
+            ORDER BY cl.id
+        """, (default_visit,))
+    else:
+        c.execute(f"""
+            SELECT NULL, NULL, NULL, a.id, l.lat, l.lon, {visit_expr}, {window_expr}
+            FROM appointments a
+            JOIN locations l ON a.id = l.appt_id
+            WHERE l.lat IS NOT NULL AND l.lon IS NOT NULL
+        """, (default_visit,))
+
+    groups = {}
+    sources = {}  # jour -> clusters existants regroupés (sortie d'un VRP précédent)
+    for cluster_name, depot_id, depot_nom, appt_id, lat, lon, visit, fixe, window_start, window_end in c.fetchall():
+        group_name = vrp_base_day(cluster_name, depot_id, depot_nom) if use_clusters else None
+        sources.setdefault(group_name, set()).add(cluster_name)
+        if not valid_coords(lat, lon):
+            print(f"[!] Coordonnée invalide ignorée : id={appt_id}, lat={lat}, lon={lon}")
+            continue
+        window = appointment_window(window_start, window_end, fixe, start_dt_base)
+        groups.setdefault(group_name, []).append((appt_id, lat, lon, int(visit), window))
+
+    if not groups:
+        print("[X] Aucun rendez-vous géocodé")
+        conn.close()
+        return
+
+    # --- Résolution ---
+    planned = []  # [(cluster_name, depot_id, route, times, result)]
+    solved = {}   # group_name -> RDV non planifiés
+    for group_name, appts in groups.items():
+        if use_clusters:
+            n_days = 1
+        else:
+            n_days = max(1, -(-len(appts) // (capacity * len(depots))))
+        vehicle_depots = [v % len(depots) for v in range(len(depots) * n_days)]
+        label = group_name or "VRP global"
+        if verbose:
+            print(f"\n--- VRP {label} : {len(appts)} RDV, {len(vehicle_depots)} véhicules ---")
+
+        result = solve_vrp(db_path, provider, label, depots, appts, vehicle_depots, capacity,
+                           ortools_time_limit_s, verbose)
+        if not result:
+            continue
+        solved[group_name] = result["dropped"]
+        if result["dropped"]:
+            print(f"[!] RDV non planifiés pour {label} : {result['dropped']}")
+
+        for vehicle, route in enumerate(result["routes"]):
+            if len(route) <= 2:
+                continue  # véhicule non utilisé
+            depot_id, depot_nom = depots[vehicle_depots[vehicle]][:2]
+            day = group_name or f"Jour {vehicle // len(depots) + 1}"
+            planned.append((vrp_cluster_name(day, depot_id, depot_nom), depot_id, route, result["times"][vehicle], result))
+
+    if not solved:
+        print("[X] Aucune tournée résolue, planning existant conservé")
+        conn.close()
+        return
+
+    # --- Écriture (clusters résolus + leurs itinéraires réécrits) ---
+    if use_clusters:
+        names = [(cluster_name,) for group_name in solved for cluster_name in sources[group_name]]
+        c.executemany("""
+            DELETE FROM itineraries
+            WHERE cluster_id IN (SELECT id FROM clusters WHERE cluster_name = ?)
+        """, names)
+        c.executemany("DELETE FROM clusters WHERE cluster_name = ?", names)
+    else:
+        c.execute("DELETE FROM itineraries")
+        c.execute("DELETE FROM clusters")
+
+    # RDV non planifiés : gardés dans un cluster (sans itinéraire) plutôt que perdus
+    c.executemany("INSERT INTO clusters (cluster_name, appt_id) VALUES (?, ?)", [
+        (group_name or UNPLANNED_CLUSTER, appt_id)
+        for group_name, dropped in solved.items()
+        for appt_id in dropped
+    ])
+
+    for cluster_name, depot_id, route, times, result in planned:
+        c.executemany(
+            "INSERT INTO clusters (cluster_name, appt_id, depot_id) VALUES (?, ?, ?)",
+            [(cluster_name, result["locations"][node][0], depot_id) for node in route[1:-1]],
+        )
+        c.execute("SELECT id FROM clusters WHERE cluster_name = ? LIMIT 1", (cluster_name,))
+        cluster_id = c.fetchone()[0]
+
+        inserts = build_itinerary_rows(cluster_id, result["locations"], {
+            "route": route,
+            "times": times,
+            "durations": result["durations"],
+            "distances": result["distances"],
+        }, start_dt_base)
         c.executemany("""
             INSERT INTO itineraries
             (cluster_id, appt_id, sequence, depart_time, arrive_time,
              duration_visit, travel_time_prev, distance_prev)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, inserts)
-        conn.commit()
-
+        count("rows.itineraries", len(inserts))
         print(f"✅ Itinéraire enregistré pour {cluster_name} ({len(inserts)} étapes)")
 
+    conn.commit()
     conn.close()
-    print("\nTSP résolution terminée.")
+    print("\nVRP résolution terminée.")
@@ -0,0 +1,188 @@
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import streamlit as st
+
+from mods.db import ui_connection
+from mods.itineraries import load_cluster_stops
+from mods.map_gen import GEOJSON_CACHE_DIR, load_cluster_geojson
+from mods.migrations import EPOCH_REVISION
+
+# ============================================================
+# Accès aux données des pages Streamlit
+# Chaque lecture est mise en cache (st.cache_data) avec, dans sa clé,
+# le compteur de modifications des tables lues (table_revisions,
+# incrémenté par triggers) et le jeton de la base (EPOCH_REVISION) :
+# le cache est servi tant que ces tables n'ont pas changé, quel que
+# soit l'écrivain, et jamais pour une base recréée au même chemin.
+# ============================================================
+
+ADRESSES_PAGE_SIZE = 100
+
+
+def _query(db_path, sql, params=()):
+    conn = ui_connection(db_path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def revisions(db_path, *tables):
+    """Jeton de la base puis compteurs de modifications des tables (dans l'ordre de `tables`)."""
+    names = (EPOCH_REVISION, *tables)
+    placeholders = ", ".join("?" for _ in names)
+    revs = dict(_query(db_path, f"SELECT name, rev FROM table_revisions WHERE name IN ({placeholders})", names))
+    return tuple(revs.get(name, 0) for name in names)
+
+
+# --- Dépôts ---
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _depots(db_path, rev):
+    return _query(db_path, "SELECT id, nom, ville FROM depots")
+
+
+def load_depots(db_path):
+    """[(id, nom, ville), ...]"""
+    return _depots(db_path, revisions(db_path, "depots"))
+
+
+# --- Itinéraires (page d'accueil) ---
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _itinerary_clusters(db_path, rev):
+    return _query(db_path, """
+        SELECT DISTINCT i.cluster_id, c.cluster_name
+        FROM itineraries i
+        JOIN clusters c ON i.cluster_id = c.id
+    """)
+
+
+def load_itinerary_clusters(db_path):
+    """[(cluster_id, cluster_name), ...] des clusters ayant un itinéraire."""
+    return _itinerary_clusters(db_path, revisions(db_path, "itineraries", "clusters"))
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _cluster_itinerary(db_path, cluster_id, rev):
+    conn = ui_connection(db_path)
+    try:
+        return load_cluster_stops(conn, cluster_id)
+    finally:
+        conn.close()
+
+
+def load_cluster_itinerary(db_path, cluster_id):
+    """Étapes d'un cluster (dicts, voir mods.itineraries), RDV, client et coordonnées joints."""
+    rev = revisions(db_path, "itineraries", "clusters", "locations", "depots", "appointments", "clients")
+    return _cluster_itinerary(db_path, cluster_id, rev)
+
+
+# Après un échec du routage, tracés en lignes droites pendant ROUTE_RETRY_S
+# au lieu d'appeler le provider (et d'attendre son timeout) à chaque affichage
+ROUTE_RETRY_S = 120
+_route_failures = {}  # profil -> instant (time.monotonic) du dernier échec
+
+
+class _RouteUnavailable(Exception):
+    """Routage en échec : porte le tracé de repli, que st.cache_data ne doit pas garder."""
+
+    def __init__(self, geojson):
+        super().__init__("routage indisponible")
+        self.geojson = geojson
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _cluster_route(db_path, cluster_id, profile, cache_dir, rev, _provider):
+    geojson = load_cluster_geojson(db_path, cluster_id, _provider, cache_dir)
+    if geojson and _provider and not geojson["properties"]["routed"]:
+        raise _RouteUnavailable(geojson)
+    return geojson
+
+
+def load_cluster_route(db_path, cluster_id, provider=None, cache_dir=GEOJSON_CACHE_DIR):
+    """
+    Artefact GeoJSON du seul cluster affiché (mods.map_gen), généré à la demande
+    dans le cache disque puis gardé en mémoire jusqu'à modification des tables lues.
+    Si le routage échoue, tracé en lignes droites (non mis en cache pour ce profil)
+    et nouvel essai après ROUTE_RETRY_S.
+    """
+    rev = revisions(db_path, "itineraries", "clusters", "locations", "depots", "appointments", "clients")
+    profile = provider.profile if provider else ""
+    failed_at = _route_failures.get(profile)
+    if provider and failed_at is not None and time.monotonic() - failed_at < ROUTE_RETRY_S:
+        provider, profile = None, ""
+    try:
+        return _cluster_route(db_path, cluster_id, profile, cache_dir, rev, provider)
+    except _RouteUnavailable as e:
+        _route_failures[profile] = time.monotonic()
+        return e.geojson
+
+
+# --- Adresses : pagination et filtre côté base ---
+
+def _adresses_filter(search):
+    if not search:
+        return "", []
+    return "WHERE c.nom LIKE ? OR a.rue LIKE ? OR a.ville LIKE ? OR a.zip LIKE ?", [f"%{search}%"] * 4
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _adresses_count(db_path, search, rev):
+    where, params = _adresses_filter(search)
+    return _query(db_path, f"""
+        SELECT COUNT(*) FROM appointments a JOIN clients c ON a.client_id = c.id {where}
+    """, params)[0][0]
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _adresses_page(db_path, search, page, page_size, rev):
+    where, params = _adresses_filter(search)
+    rows = _query(db_path, f"""
+        SELECT a.id, c.nom AS client, a.num, a.rue, a.ville, a.zip, a.type
+        FROM appointments a
+        JOIN clients c ON a.client_id = c.id
+        {where}
+        ORDER BY c.nom, a.id
+        LIMIT ? OFFSET ?
+    """, params + [page_size, page * page_size])
+    return pd.DataFrame(rows, columns=["id", "Client", "Num", "Rue", "Ville", "Zip", "Type"])
+
+
+def count_adresses(db_path, search=""):
+    """Nombre de RDV correspondant au filtre (client, rue, ville ou code postal)."""
+    return _adresses_count(db_path, search.strip(), revisions(db_path, "appointments", "clients"))
+
+
+def load_adresses_page(db_path, search="", page=0, page_size=ADRESSES_PAGE_SIZE):
+    """Une page (numérotée depuis 0) des RDV filtrés, avec le nom du client."""
+    rev = revisions(db_path, "appointments", "clients")
+    return _adresses_page(db_path, search.strip(), page, page_size, rev)
+
+
+# --- Planning : événements d'une plage de dates ---
+
+# Durée maximale d'un RDV prise en compte pour borner la recherche par index
+MAX_EVENT_SPAN = timedelta(days=7)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _events_between(db_path, start, end, rev):
+    lower = (datetime.fromisoformat(start) - MAX_EVENT_SPAN).isoformat()
+    rows = _query(db_path, """
+        SELECT id, title, start_time, end_time
+        FROM appointments
+        WHERE start_time >= ? AND start_time < ? AND COALESCE(end_time, start_time) >= ?
+        ORDER BY start_time
+    """, (lower, end, start))
+    return [{"id": r[0], "title": r[1], "start": r[2], "end": r[3]} for r in rows]
+
+
+def load_events(db_path, start, end):
+    """
+    Événements du calendrier qui chevauchent [start, end) (chaînes ISO),
+    via l'index sur start_time (RDV de moins de MAX_EVENT_SPAN).
+    """
+    return _events_between(db_path, start, end, revisions(db_path, "appointments"))
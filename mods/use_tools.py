@@ -36,3 +36,39 @@ def fmt_time_iso(iso_str: str | None, show_date: bool = False) -> str:
             dt = dt.astimezone(PARIS)
 
     return dt.strftime("%d/%m %H:%M") if show_date else dt.strftime("%H:%M")
+
+
+def time_offset_s(value, base_dt: datetime) -> int | None:
+    """
+    Secondes entre base_dt et l'heure de `value`.
+    Accepte 'HH:MM', 'HH:MM:SS' (pris le jour de base_dt) ou un ISO datetime : avec fuseau
+    ('Z', '+00:00'), il est converti en heure de Paris ; daté d'un autre jour que base_dt,
+    il est ignoré (avertissement).
+    Retourne None si value est vide, invalide ou d'un autre jour.
+    """
+    if not value:
+        return None
+
+    s = str(value).strip()
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+
+    if PARIS and base_dt.tzinfo is not None:
+        base_dt = base_dt.astimezone(PARIS)
+    base_dt = base_dt.replace(tzinfo=None)
+
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        try:
+            t = datetime.strptime(s, "%H:%M:%S" if s.count(":") == 2 else "%H:%M").time()
+        except ValueError:
+            return None
+        dt = datetime.combine(base_dt.date(), t)
+
+    if dt.tzinfo is not None:
+        dt = (dt.astimezone(PARIS) if PARIS else dt).replace(tzinfo=None)
+    if dt.date() != base_dt.date():
+        print(f"[!] Horaire {value} daté d'un autre jour que la tournée ({base_dt.date()}), ignoré")
+        return None
+    return int((dt - base_dt).total_seconds())
@@ -1,6 +1,10 @@
 import streamlit as st
+import pandas as pd
 import os
+import sqlite3
 from mods.rebuild_db import rebuild_database
+from mods.db import checkpoint, ui_connection
+from mods.profiling import recent_runs, time_breakdown
 
 
 from dotenv import load_dotenv
@@ -26,6 +30,7 @@ st.markdown("---")
 # Sauvegarde DB
 st.subheader("💾 Sauvegarder la base de données")
 if os.path.exists(DB_PATH):
+    checkpoint(DB_PATH)  # écritures encore dans le journal WAL
     with open(DB_PATH, "rb") as f:
         st.download_button(
             label="⬇️ Télécharger",
@@ -35,3 +40,65 @@ if os.path.exists(DB_PATH):
         )
 else:
     st.error("❌ Aucune base trouvée.")
+
+
+st.markdown("---")
+
+# Mesures du pipeline d'optimisation
+st.subheader("⏱️ Mesures des optimisations")
+
+runs = None
+if not os.path.exists(DB_PATH):
+    st.info("ℹ️ Aucune base trouvée : pas de mesures.")
+else:
+    conn = ui_connection(DB_PATH)
+    try:
+        runs = recent_runs(conn, "optimisation", limit=20)  # JOB_KIND de la page d'accueil
+    except sqlite3.OperationalError:
+        st.info("ℹ️ Table pipeline_runs absente : reconstruire la base pour activer les mesures.")
+    finally:
+        conn.close()
+
+if runs is not None and not runs:
+    st.info("ℹ️ Aucune optimisation mesurée pour l'instant.")
+elif runs:
+    # Une ligne par exécution : durée totale, durée par étape, appels ORS
+    rows = []
+    for run in runs:
+        row = {"Début": run["started_at"], "Statut": run["status"], "Total (s)": run["duration_s"]}
+        for name, timer_ in run["timers"].items():
+            if name.startswith("stage."):
+                row[name[len("stage."):]] = round(timer_["total_s"], 2)
+        row["Appels ORS"] = sum(n for name, n in run["counters"].items() if name.startswith("ors."))
+        rows.append(row)
+    history = pd.DataFrame(rows)
+    st.dataframe(history, hide_index=True, width="stretch")
+
+    stage_columns = [col for col in history.columns if col not in ("Début", "Statut", "Total (s)", "Appels ORS")]
+    if len(history) > 1 and stage_columns:
+        st.caption("Durée des étapes par exécution (s)")
+        st.line_chart(history.set_index("Début")[stage_columns].iloc[::-1])
+
+    # Détail d'une exécution
+    run = st.selectbox(
+        "Détail de l'exécution :",
+        options=runs,
+        format_func=lambda r: f"#{r['id']} — {r['started_at']} ({r['status']}, {r['duration_s']:.1f} s)",
+    )
+    breakdown = time_breakdown(run["timers"])
+    cols = st.columns(max(len(breakdown), 1))
+    for col, (label, seconds) in zip(cols, breakdown.items()):
+        col.metric(label, f"{seconds:.1f} s")
+
+    col_timers, col_counters = st.columns(2)
+    with col_timers:
+        st.markdown("**Chronomètres** (cumulés)")
+        st.dataframe(pd.DataFrame(
+            [(name, t["count"], round(t["total_s"], 3)) for name, t in sorted(run["timers"].items())],
+            columns=["Mesure", "Appels", "Durée (s)"],
+        ), hide_index=True, width="stretch")
+    with col_counters:
+        st.markdown("**Compteurs**")
+        values = {**run["counters"], **run["metrics"]}
+        st.dataframe(pd.DataFrame(sorted(values.items()), columns=["Compteur", "Valeur"]),
+                     hide_index=True, width="stretch")
@@ -1,9 +1,12 @@
 import streamlit as st
-import pandas as pd
-import sqlite3
+import math
 import os
 from dotenv import load_dotenv
 
+from mods.db import ui_connection
+from mods.ui_data import count_adresses, load_adresses_page
+from mods.adresses import full_address, import_appointments_csv, apply_editor_changes
+
 # --- Config ---
 load_dotenv(dotenv_path=".secret")
 DB_PATH = os.getenv("DB_PATH")
@@ -16,22 +19,6 @@ if "message" not in st.session_state:
 # 🧰 Helpers DB
 # ============================================================
 
-def get_adresses():
-    """Récupère la liste des rendez-vous avec le nom du client."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        SELECT a.id, c.nom AS client, a.num, a.rue, a.ville, a.zip, a.type
-        FROM appointments a
-        JOIN clients c ON a.client_id = c.id
-        ORDER BY c.nom
-    """)
-    rows = c.fetchall()
-    conn.close()
-    df = pd.DataFrame(rows, columns=["id", "Client", "Num", "Rue", "Ville", "Zip", "Type"])
-    return df
-
-
 def get_or_create_client(conn, name, address):
     """Vérifie si un client existe (nom + adresse). Sinon, le crée."""
     c = conn.cursor()
@@ -46,8 +33,8 @@ def get_or_create_client(conn, name, address):
 
 def add_adresse(client_name, num, rue, ville, zip_code, type_):
     """Ajoute un rendez-vous et crée le client s’il n’existe pas."""
-    conn = sqlite3.connect(DB_PATH)
-    address = f"{num} {rue}, {ville} {zip_code}"
+    conn = ui_connection(DB_PATH)
+    address = full_address(num, rue, ville, zip_code)
     client_id = get_or_create_client(conn, client_name, address)
 
     c = conn.cursor()
@@ -59,15 +46,6 @@ def add_adresse(client_name, num, rue, ville, zip_code, type_):
     conn.close()
 
 
-def delete_adresses(ids):
-    """Supprime des rendez-vous (les clients restent)."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.executemany("DELETE FROM appointments WHERE id=?", [(i,) for i in ids])
-    conn.commit()
-    conn.close()
-
-
 # ============================================================
 # 🖥️ Interface Streamlit
 # ============================================================
@@ -82,11 +60,13 @@ if st.session_state["message"]:
         st.session_state["message"] = (st.session_state["message"][0], 2)
         st.success(st.session_state["message"][0])
 
-# --- Charger les données ---
-if "adresses" not in st.session_state:
-    st.session_state["adresses"] = get_adresses()
+# --- Rechargement après écriture ---
+def reload_adresses():
+    """Les lectures suivent table_revisions ; la nouvelle clé du data_editor repart d'un delta vide."""
+    st.session_state["editor_version"] = st.session_state.get("editor_version", 0) + 1
+
 
-df = st.session_state["adresses"]
+st.session_state.setdefault("editor_version", 0)
 
 # ============================================================
 # 📋 Liste des rendez-vous
@@ -94,48 +74,40 @@ df = st.session_state["adresses"]
 
 st.subheader("📋 Liste des rendez-vous")
 
-edited_df = st.data_editor(
+# --- Filtre et pagination côté base ---
+col_search, col_size, col_page = st.columns([3, 1, 1])
+search = col_search.text_input("🔎 Rechercher (client, rue, ville, code postal)")
+page_size = col_size.selectbox("Lignes par page", [50, 100, 250, 500], index=1)
+total = count_adresses(DB_PATH, search)
+n_pages = max(1, math.ceil(total / page_size))
+page = col_page.number_input(f"Page (sur {n_pages})", min_value=1, max_value=n_pages, value=1) - 1
+st.caption(f"{total} rendez-vous")
+
+df = load_adresses_page(DB_PATH, search, page, page_size)
+editor_key = f"table_editor_{st.session_state['editor_version']}_{search}_{page}_{page_size}"
+
+st.data_editor(
     df,
     num_rows="dynamic",
     width="stretch",
     disabled=["id"],
-    key="table_editor"
+    key=editor_key
 )
 
 if st.button("💾 Mettre à jour la base"):
-    df = edited_df
-    df_orig = st.session_state["adresses"]
-
-    # --- 1️⃣ Suppression ---
-    ids_suppr = df_orig[~df_orig["id"].isin(df["id"])]["id"].tolist()
-    if ids_suppr:
-        delete_adresses(ids_suppr)
-
-    # --- 2️⃣ Modification ---
-    cols_editables = ["Client", "Num", "Rue", "Ville", "Zip", "Type"]
-    df_merge = df.merge(df_orig, on="id", suffixes=("_new", "_old"))
-    for _, row in df_merge.iterrows():
-        updates = {col: row[f"{col}_new"] for col in cols_editables if row[f"{col}_new"] != row[f"{col}_old"]}
-        if updates:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-
-            # Si le client change → recréer un client si besoin
-            if "Client" in updates:
-                full_address = f"{row['Num_new']} {row['Rue_new']}, {row['Ville_new']} {row['Zip_new']}"
-                client_id = get_or_create_client(conn, updates["Client"], full_address)
-                updates["client_id"] = client_id
-                del updates["Client"]
-
-            set_str = ", ".join([f"{col.lower()} = ?" for col in updates])
-            values = list(updates.values()) + [row["id"]]
-            c.execute(f"UPDATE appointments SET {set_str} WHERE id = ?", values)
-            conn.commit()
-            conn.close()
+    # Delta du tableau : seules les lignes modifiées, ajoutées ou supprimées
+    conn = ui_connection(DB_PATH)
+    try:
+        counts = apply_editor_changes(conn, df, st.session_state[editor_key])
+    finally:
+        conn.close()
 
     # --- Rechargement ---
-    st.session_state["adresses"] = get_adresses()
-    st.session_state["message"] = ("✅ Base de données mise à jour !", 1)
+    reload_adresses()
+    st.session_state["message"] = (
+        f"✅ Base de données mise à jour ! ({counts['updated']} modifiés, "
+        f"{counts['added']} ajoutés, {counts['deleted']} supprimés)", 1
+    )
     st.rerun()
 
 
@@ -161,7 +133,7 @@ with st.form("add_adresse_form"):
         else:
             add_adresse(client, num, rue, ville, zip_code, type_)
             st.success("✅ Rendez-vous ajouté !")
-            st.session_state["adresses"] = get_adresses()
+            reload_adresses()
             st.rerun()
 
 
@@ -174,24 +146,19 @@ st.subheader("📥 Importer un fichier CSV")
 
 uploaded_file = st.file_uploader("Choisissez un fichier CSV", type="csv")
 
-if uploaded_file is not None:
-    df_csv = pd.read_csv(uploaded_file)
-
-    expected_cols = ["Client", "Num", "Rue", "Ville", "Zip", "Type"]
-    if not all(col in df_csv.columns for col in expected_cols):
-        st.error(f"Le CSV doit contenir les colonnes suivantes : {expected_cols}")
+# Un fichier déjà importé reste sélectionné après st.rerun() : on ne l'importe qu'une fois
+if uploaded_file is not None and st.session_state.get("imported_file") != uploaded_file.file_id:
+    conn = ui_connection(DB_PATH)
+    try:
+        n_appts, n_clients = import_appointments_csv(conn, uploaded_file)
+    except ValueError as e:
+        st.error(str(e))
     else:
-        conn = sqlite3.connect(DB_PATH)
-        for _, row in df_csv.iterrows():
-            address = f"{row['Num']} {row['Rue']}, {row['Ville']} {row['Zip']}"
-            client_id = get_or_create_client(conn, row["Client"], address)
-            c = conn.cursor()
-            c.execute("""
-                INSERT INTO appointments (client_id, num, rue, ville, zip, type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (client_id, row["Num"], row["Rue"], row["Ville"], row["Zip"], row["Type"]))
-        conn.commit()
-        conn.close()
-        st.success("✅ Fichier importé et rendez-vous ajoutés !")
-        st.session_state["adresses"] = get_adresses()
+        st.session_state["imported_file"] = uploaded_file.file_id
+        st.session_state["message"] = (
+            f"✅ Fichier importé : {n_appts} rendez-vous ajoutés, {n_clients} nouveaux clients.", 1
+        )
+        reload_adresses()
         st.rerun()
+    finally:
+        conn.close()
@@ -1,5 +1,6 @@
 import streamlit as st
-import sqlite3,requests
+from mods.db import ui_connection
+from mods.geocode import geocode_address as geocode_cached_address
 
 import os
 from dotenv import load_dotenv
@@ -12,7 +13,7 @@ if "message" not in st.session_state:
 
 # --- Helpers DB ---
 def get_depots():
-    conn = sqlite3.connect(DB_PATH)
+    conn = ui_connection(DB_PATH)
     c = conn.cursor()
     c.execute("SELECT id, nom, num, rue, ville, zip, lat, lon FROM depots")
     depots = c.fetchall()
@@ -20,7 +21,7 @@ def get_depots():
     return depots
 
 def add_depot(nom, num, rue, ville, zip, lat, lon):
-    conn = sqlite3.connect(DB_PATH)
+    conn = ui_connection(DB_PATH)
     c = conn.cursor()
     c.execute(
         "INSERT INTO depots (nom, num, rue, ville, zip, lat, lon) VALUES (?, ?, ?, ?, ?, ?, ?)",
@@ -30,7 +31,7 @@ def add_depot(nom, num, rue, ville, zip, lat, lon):
     conn.close()
 
 def update_depot(depot_id, nom, num, rue, ville, zip, lat, lon):
-    conn = sqlite3.connect(DB_PATH)
+    conn = ui_connection(DB_PATH)
     c = conn.cursor()
     c.execute(
         "UPDATE depots SET nom=?, num=?, rue=?, ville=?, zip=?, lat=?, lon=? WHERE id=?",
@@ -40,7 +41,7 @@ def update_depot(depot_id, nom, num, rue, ville, zip, lat, lon):
     conn.close()
 
 def delete_depot(depot_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = ui_connection(DB_PATH)
     c = conn.cursor()
     c.execute("DELETE FROM depots WHERE id=?", (depot_id,))
     conn.commit()
@@ -48,17 +49,13 @@ def delete_depot(depot_id):
 
 # --- Géocodage ORS ---
 def geocode_address(num, rue, ville, zip):
-    """Retourne (lat, lon) depuis une adresse en utilisant ORS."""
+    """Retourne (lat, lon) depuis une adresse (cache geocode_cache puis ORS)."""
     address = f"{num} {rue}, {zip} {ville}"
-    url = "https://api.openrouteservice.org/geocode/search"
-    params = {"api_key": ORS_API_KEY, "text": address}
-    resp = requests.get(url, params=params)
-    if resp.status_code == 200:
-        features = resp.json().get("features", [])
-        if features:
-            coords = features[0]["geometry"]["coordinates"]
-            return coords[1], coords[0]  # (lat, lon)
-    return None, None
+    conn = ui_connection(DB_PATH)
+    try:
+        return geocode_cached_address(address, ORS_API_KEY, conn)
+    finally:
+        conn.close()
 
 if st.session_state["message"]:
     if st.session_state["message"][1] > 1:
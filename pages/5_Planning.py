@@ -1,11 +1,14 @@
 # Agendix/pages/5_Planning.py
 import streamlit as st
 from streamlit_calendar import calendar
-import sqlite3,os
-from datetime import datetime, timedelta
+import os
+from datetime import date, datetime, timedelta
 
 from dotenv import load_dotenv
 
+from mods.db import ui_connection
+from mods.ui_data import load_events
+
 load_dotenv(dotenv_path=".secret")
 DB_PATH = os.getenv("DB_PATH")
 
@@ -15,26 +18,8 @@ st.title("📅 Planning des rendez-vous")
 
 
 # --- Fonctions BDD ---
-def get_appointments():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, start_time, end_time FROM appointments")
-    rows = cur.fetchall()
-    conn.close()
-
-    events = []
-    for r in rows:
-        events.append({
-            "id": r[0],
-            "title": r[1],
-            "start": r[2],
-            "end": r[3],
-        })
-    return events
-
-
 def add_appointment(title, start, end):
-    conn = sqlite3.connect(DB_PATH)
+    conn = ui_connection(DB_PATH)
     cur = conn.cursor()
     cur.execute("INSERT INTO appointments (title, start_time, end_time) VALUES (?, ?, ?)", (title, start, end))
     conn.commit()
@@ -42,7 +27,7 @@ def add_appointment(title, start, end):
 
 
 def update_appointment(id, start, end):
-    conn = sqlite3.connect(DB_PATH)
+    conn = ui_connection(DB_PATH)
     cur = conn.cursor()
     cur.execute("UPDATE appointments SET start_time=?, end_time=? WHERE id=?", (start, end, id))
     conn.commit()
@@ -50,31 +35,75 @@ def update_appointment(id, start, end):
 
 
 def delete_appointment(id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = ui_connection(DB_PATH)
     cur = conn.cursor()
     cur.execute("DELETE FROM appointments WHERE id=?", (id,))
     conn.commit()
     conn.close()
 
 
+# --- Plage affichée ---
+# streamlit-calendar ne renvoie pas la plage visible : la navigation se fait ici,
+# et seuls les RDV de la plage sont chargés.
+VIEWS = {
+    "Semaine": "timeGridWeek",
+    "Mois": "dayGridMonth",
+    "Jour": "timeGridDay",
+    "Liste": "listWeek",
+}
+
+
+def visible_range(view, anchor):
+    """(début, fin) de la grille affichée par FullCalendar pour la vue et la date données."""
+    if view == "timeGridDay":
+        return anchor, anchor + timedelta(days=1)
+    if view == "dayGridMonth":
+        first = anchor.replace(day=1)
+        start = first - timedelta(days=first.weekday())
+        return start, start + timedelta(days=42)  # 6 semaines affichées
+    start = anchor - timedelta(days=anchor.weekday())
+    return start, start + timedelta(days=7)
+
+
+def shift(view, anchor, step):
+    """Date de la période précédente (step=-1) ou suivante (step=1)."""
+    if view == "timeGridDay":
+        return anchor + timedelta(days=step)
+    if view == "dayGridMonth":
+        month = anchor.month - 1 + step
+        return date(anchor.year + month // 12, month % 12 + 1, 1)
+    return anchor + timedelta(days=7 * step)
+
+
+st.session_state.setdefault("planning_date", date.today())
+
 # --- Affichage du calendrier ---
 st.subheader("Vue calendrier")
 
-events = get_appointments()
+col_view, col_prev, col_today, col_next = st.columns([3, 1, 1, 1])
+view = VIEWS[col_view.selectbox("Vue", list(VIEWS))]
+if col_prev.button("◀"):
+    st.session_state["planning_date"] = shift(view, st.session_state["planning_date"], -1)
+if col_today.button("Aujourd'hui"):
+    st.session_state["planning_date"] = date.today()
+if col_next.button("▶"):
+    st.session_state["planning_date"] = shift(view, st.session_state["planning_date"], 1)
+
+anchor = st.session_state["planning_date"]
+range_start, range_end = visible_range(view, anchor)
+events = load_events(DB_PATH, datetime.combine(range_start, datetime.min.time()).isoformat(),
+                     datetime.combine(range_end, datetime.min.time()).isoformat())
 
 state = calendar(
     events=events,
     options={
         "editable": True,
-        "initialView": "timeGridWeek",
+        "initialView": view,
+        "initialDate": anchor.isoformat(),
         "locale": "fr",
-        "headerToolbar": {
-            "left": "prev,next today",
-            "center": "title",
-            "right": "dayGridMonth,timeGridWeek,timeGridDay,listWeek"
-        },
+        "headerToolbar": {"left": "", "center": "title", "right": ""},
     },
-    key="calendar",
+    key=f"calendar_{view}_{anchor.isoformat()}",
 )
 
 # --- Événements du calendrier ---
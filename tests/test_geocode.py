@@ -0,0 +1,149 @@
+"""
+Tests du géocodage (mods.geocode) contre un faux serveur ORS local :
+réessais sur 429/5xx, cadence du token bucket, mise en cache des échecs.
+
+    python -m pytest tests
+"""
+import json
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from mods.geocode import TokenBucket, fetch_geocode, geocode_cached
+
+FOUND = {"features": [{"geometry": {"coordinates": [2.3522, 48.8566]}}]}
+NOT_FOUND = {"features": []}
+
+
+class StubORS(ThreadingHTTPServer):
+    """Faux geocode/search : rejoue `responses` [(status, corps, en-têtes)], puis répète la dernière."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.responses = [(200, FOUND, {})]
+        self.requests = []  # (instant, texte demandé)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/geocode/search"
+
+    def next_response(self, text):
+        with self.lock:
+            self.requests.append((time.monotonic(), text))
+            return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        text = parse_qs(urlparse(self.path).query).get("text", [""])[0]
+        status, body, headers = self.server.next_response(text)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ors():
+    server = StubORS()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def session():
+    with requests.Session() as s:
+        yield s
+
+
+# ============================================================
+# Réessais (429 / 5xx)
+# ============================================================
+
+def test_retry_after_429(ors, session):
+    ors.responses = [(429, {}, {"Retry-After": "0"}), (429, {}, {"Retry-After": "0"}), (200, FOUND, {})]
+    assert fetch_geocode("1 rue A", "key", session, base_url=ors.url) == ("ok", 48.8566, 2.3522)
+    assert len(ors.requests) == 3
+
+
+def test_exponential_backoff_without_retry_after(ors, session):
+    ors.responses = [(429, {}, {}), (503, {}, {}), (200, FOUND, {})]
+    start = time.monotonic()
+    status, _, _ = fetch_geocode("1 rue A", "key", session, base_url=ors.url, backoff_s=0.05)
+    assert status == "ok"
+    assert time.monotonic() - start >= 0.05 + 0.1  # backoff_s * 2**0 + backoff_s * 2**1
+
+
+def test_gives_up_after_max_retries(ors, session):
+    ors.responses = [(429, {}, {"Retry-After": "0"})]
+    assert fetch_geocode("1 rue A", "key", session, base_url=ors.url, max_retries=2) == ("error", None, None)
+    assert len(ors.requests) == 3
+
+
+# ============================================================
+# Cadence (TokenBucket)
+# ============================================================
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate_per_min=600, burst=2)  # 10 jetons/s
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.35  # 2 jetons immédiats, 4 à 0,1 s
+
+
+def test_requests_paced_by_shared_limiter(ors, session):
+    limiter = TokenBucket(rate_per_min=1200, burst=1)  # 20 requêtes/s
+    threads = [
+        threading.Thread(target=fetch_geocode, args=(f"{i} rue A", "key", session, limiter, ors.url))
+        for i in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    times = sorted(t for t, _ in ors.requests)
+    assert len(times) == 5
+    assert times[-1] - times[0] >= 4 * 0.05 * 0.8
+
+
+# ============================================================
+# Cache (geocode_cache)
+# ============================================================
+
+def test_miss_is_cached(ors):
+    conn = sqlite3.connect(":memory:")
+    ors.responses = [(200, NOT_FOUND, {})]
+
+    assert geocode_cached(["nulle part"], "key", conn, base_url=ors.url) == {"nulle part": (None, None)}
+    assert conn.execute("SELECT status, lat, lon FROM geocode_cache").fetchall() == [("miss", None, None)]
+
+    assert geocode_cached(["Nulle Part"], "key", conn, base_url=ors.url) == {"Nulle Part": (None, None)}
+    assert len(ors.requests) == 1
+
+
+def test_transient_error_is_not_cached(ors):
+    conn = sqlite3.connect(":memory:")
+    ors.responses = [(503, {}, {"Retry-After": "0"})]
+
+    assert geocode_cached(["1 rue A"], "key", conn, base_url=ors.url) == {"1 rue A": (None, None)}
+    assert conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0] == 0
+
+    ors.responses = [(200, FOUND, {})]
+    assert geocode_cached(["1 rue A"], "key", conn, base_url=ors.url) == {"1 rue A": (48.8566, 2.3522)}